@@ -1,14 +1,17 @@
-from flask import Blueprint, request, jsonify
-import sqlite3
+from flask import Blueprint, request, jsonify, session
+from db import get_db_connection
+from utils.auth import is_admin
+from utils.revocation import REVOCATION_VERSION_SQL, is_revoked
+from utils.metering import record_hit, get_usage, get_hourly_usage
+from utils.scopes import userinfo_fields
+from utils.security import hash_token
+from utils.suggestions import list_suggestions, search_suggestions, create_suggestion
+from utils.writer import run_write
 
 handle_bp = Blueprint("handle_requests", __name__, url_prefix="/api")
 
-DB_PATH = "stybase.db"
-
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_db_connection()
 
 # Mock token validation (replace with real validation in production)
 def validate_access_token(token):
@@ -19,7 +22,7 @@ def validate_access_token(token):
 def userinfo():
     """
     Client apps hit this route with access_token to fetch user info.
-    Returns username + app_password.
+    Returns only the fields released by the token's granted scopes.
     """
     data = request.get_json()
     access_token = data.get("access_token")
@@ -31,12 +34,13 @@ def userinfo():
     cur = conn.cursor()
 
     # Look up token
-    cur.execute("""
-        SELECT u.username, u.email, u.name, u.phone, u.app_password, t.expires_at, t.revoked
+    cur.execute(f"""
+        SELECT u.username, u.email, u.name, u.phone, u.app_password,
+               t.id, t.user_id, t.app_id, t.scope_mask, t.expires_at, t.revoked, {REVOCATION_VERSION_SQL}
         FROM oauth_tokens t
         JOIN users u ON t.user_id = u.id
-        WHERE t.access_token=?
-    """, (access_token,))
+        WHERE t.access_token_hash=?
+    """, (hash_token(str(access_token)),))
     row = cur.fetchone()
 
     if not row:
@@ -46,18 +50,79 @@ def userinfo():
     # Expiry + revoke check
     from datetime import datetime
     expires_at = datetime.fromisoformat(row["expires_at"])
-    if row["revoked"]:
+    if is_revoked(cur, row):
         conn.close()
+        record_hit(row["app_id"], "error")
         return jsonify({"error": "revoked_token"}), 401
     if expires_at < datetime.utcnow():
         conn.close()
+        record_hit(row["app_id"], "error")
         return jsonify({"error": "expired_token"}), 401
 
     conn.close()
+    record_hit(row["app_id"], "userinfo")
+    fields = userinfo_fields(row["scope_mask"])
+    return jsonify(dict(zip(fields, [row[f] for f in fields])))
+
+@handle_bp.route("/apps/<int:app_id>/usage", methods=["GET"])
+def app_usage(app_id):
+    """
+    Usage totals and hourly breakdown for one app.
+    Visible to the app owner and admins. Optional ?hours= (default 24).
+    """
+    if "user_id" not in session:
+        return jsonify({"error": "unauthorized"}), 401
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT owner_id FROM apps WHERE id=?", (app_id,))
+    app = cur.fetchone()
+    conn.close()
+    if not app:
+        return jsonify({"error": "not_found"}), 404
+    if app["owner_id"] != session["user_id"] and not is_admin():
+        return jsonify({"error": "forbidden"}), 403
+
+    hours = min(max(request.args.get("hours", 24, type=int), 1), 24 * 90)
     return jsonify({
-        "username": row["username"],
-        "email": row["email"],
-        "name": row["name"],
-        "phone": row["phone"],
-        "app_password": row["app_password"],
+        "app_id": app_id,
+        "hours": hours,
+        "totals": get_usage([app_id], hours)[app_id],
+        "hourly": [dict(r) for r in get_hourly_usage(app_id, hours)],
     })
+
+# ---------------- Suggestions ----------------
+@handle_bp.route("/suggestions", methods=["GET"])
+def suggestions_feed():
+    """
+    Newest suggestions first. Optional ?q= (full-text search), ?user_id=,
+    ?limit= and ?cursor= (the next_cursor of the previous page).
+    """
+    q = request.args.get("q", "").strip()
+    cursor = request.args.get("cursor") or None
+    limit = request.args.get("limit", type=int)
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        if q:
+            page = search_suggestions(cur, q, limit, cursor)
+        else:
+            page = list_suggestions(cur, limit, cursor, request.args.get("user_id", type=int))
+    except ValueError as e:
+        return jsonify({"error": "invalid_request", "message": str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify(page)
+
+@handle_bp.route("/suggestions", methods=["POST"])
+def add_suggestion():
+    """Create a suggestion as the signed-in user. JSON body: title, content."""
+    if "user_id" not in session:
+        return jsonify({"error": "unauthorized"}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        suggestion_id = run_write(create_suggestion, session["user_id"], data.get("title"), data.get("content"))
+    except ValueError as e:
+        return jsonify({"error": "invalid_request", "message": str(e)}), 400
+    return jsonify({"id": suggestion_id}), 201
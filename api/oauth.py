@@ -1,27 +1,66 @@
-from flask import Blueprint, request, session, redirect, url_for, jsonify
+from flask import Blueprint, request, session, redirect, url_for, jsonify, render_template
 from utils.auth import get_user_by_id, is_admin
-from utils.security import generate_token
+from utils.security import generate_token, hash_token
+from utils.revocation import revoke_app_tokens, revoke_grant_tokens
+from utils.metering import record_hit
+from utils.redirect_uris import URI_VERSION_SQL, get_matcher
+from utils.scopes import compile_scope, InvalidScope
+from utils.writer import run_write
+from utils import realtime, webhooks
 from db import get_db_connection
 from datetime import datetime, timedelta
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 oauth_bp = Blueprint("oauth", __name__, url_prefix="/oauth")
 
 def _add_qs(url: str, extra: dict) -> str:
-    """Merge querystring params into a URL."""
+    """
+    Merge querystring params into a URL.
+    Redirect URIs are validated before we get here (no fragment), so the
+    params can usually just be appended; the URL is only re-parsed when it
+    already carries one of the keys being set.
+    """
+    extra = {k: v for k, v in extra.items() if v is not None and v != ""}
+    base, sep, query = url.partition("?")
+    if not sep:
+        return f"{url}?{urlencode(extra)}" if extra else url
+    if not any(f"{k}=" in query for k in extra):
+        return f"{url}&{urlencode(extra)}" if query and extra else f"{url}{urlencode(extra)}"
+
     parts = list(urlparse(url))
     q = dict(parse_qsl(parts[4], keep_blank_values=True))
-    for k, v in list(extra.items()):
-        if v is None or v == "":
-            extra.pop(k, None)
     q.update(extra)
     parts[4] = urlencode(q)
     return urlunparse(parts)
 
+def _normalize_scope(scope: str) -> str:
+    """Canonical scope-set text: unique, sorted, space separated."""
+    return " ".join(sorted(set(scope.split())))
+
+def _has_consent(cur, user_id, app_id, scope_mask: int) -> bool:
+    """True if an unrevoked grant for this user/app already covers every requested scope bit."""
+    cur.execute("""
+        SELECT 1 FROM oauth_authorizations
+        WHERE user_id=? AND app_id=? AND revoked=0 AND (scope_mask & ?) = ?
+        LIMIT 1
+    """, (user_id, app_id, scope_mask, scope_mask))
+    return cur.fetchone() is not None
+
+def _issue_code(cur, user_id, app_id, redirect_uri, scope, scope_mask):
+    """Store a short-lived auth code for the token exchange and return it."""
+    code = generate_token(32)
+    expires_at = (datetime.utcnow() + timedelta(minutes=10)).isoformat(timespec="seconds")
+    cur.execute("""
+        INSERT INTO oauth_codes (code_hash, user_id, app_id, redirect_uri, scope, scope_mask, expires_at, used)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+    """, (hash_token(code), user_id, app_id, redirect_uri, scope, scope_mask, expires_at))
+    return code
+
 @oauth_bp.route("/authorize", methods=["GET", "POST"])
 def authorize():
     """
     Step 1: User authorization (consent) screen.
-    Accepts: client_id, redirect_uri, scope, response_type=code, state (optional)
+    Accepts: client_id, redirect_uri, scope, response_type=code, state (optional),
+    prompt=consent (optional, always show the consent screen)
     """
     # Require login (preserve return-to)
     user_id = session.get("user_id")
@@ -31,9 +70,10 @@ def authorize():
     # Read params from GET (first load) or POST (form submit)
     client_id = request.values.get("client_id", "").strip()
     redirect_uri = request.values.get("redirect_uri", "").strip()
-    scope = request.values.get("scope", "").strip()
+    scope = _normalize_scope(request.values.get("scope", ""))
     state = request.values.get("state", "").strip()
     response_type = request.values.get("response_type", "code").strip()
+    prompt = request.values.get("prompt", "").strip()
 
     # Basic validation
     if not client_id or not redirect_uri:
@@ -44,18 +84,25 @@ def authorize():
     # Lookup app
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT id, name, redirect_uri FROM apps WHERE client_id=?", (client_id,))
+    cur.execute(f"SELECT id, name, redirect_uri, {URI_VERSION_SQL} FROM apps WHERE client_id=?", (client_id,))
     app = cur.fetchone()
     if not app:
         conn.close()
         return "Invalid client_id", 400
 
-    # Validate redirect_uri against registered URIs (space/newline separated list allowed)
-    registered_uris = (app["redirect_uri"] or "").split()
-    if redirect_uri not in registered_uris:
+    # Validate redirect_uri against the app's compiled URI registry
+    if not get_matcher(cur, app).matches(redirect_uri):
         conn.close()
+        record_hit(app["id"], "error")
         return "Invalid redirect_uri for this client_id", 400
 
+    try:
+        scope_mask = compile_scope(scope)
+    except InvalidScope:
+        conn.close()
+        record_hit(app["id"], "error")
+        return redirect(_add_qs(redirect_uri, {"error": "invalid_scope", "state": state}))
+
     if request.method == "POST":
         action = request.form.get("action")
 
@@ -64,28 +111,31 @@ def authorize():
             # Pass through error and optional state
             return redirect(_add_qs(redirect_uri, {"error": "access_denied", "state": state}))
 
-        # Approve: record authorization (idempotent-ish)
-        cur.execute("""
-            INSERT INTO oauth_authorizations (user_id, app_id, authorized_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """, (user_id, app["id"]))
-
-        # Issue short-lived auth code and store it for the token exchange
-        code = generate_token(32)
-        expires_at = (datetime.utcnow() + timedelta(minutes=10)).isoformat(timespec="seconds")
+        conn.close()
 
-        # Requires oauth_codes table (DDL provided below)
-        cur.execute("""
-            INSERT INTO oauth_codes (code, user_id, app_id, redirect_uri, scope, expires_at, used)
-            VALUES (?, ?, ?, ?, ?, ?, 0)
-        """, (code, user_id, app["id"], redirect_uri, scope, expires_at))
+        def approve(wcur):
+            # Approve: remember consent, one row per (user, app, scope set)
+            wcur.execute("""
+                INSERT INTO oauth_authorizations (user_id, app_id, scope, scope_mask, authorized_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id, app_id, scope)
+                DO UPDATE SET authorized_at=CURRENT_TIMESTAMP, revoked=0
+            """, (user_id, app["id"], scope, scope_mask))
+            return _issue_code(wcur, user_id, app["id"], redirect_uri, scope, scope_mask)
 
-        conn.commit()
-        conn.close()
+        code = run_write(approve)
+        record_hit(app["id"], "authorize")
 
         # Redirect back to client with code (+ state if provided)
         return redirect(_add_qs(redirect_uri, {"code": code, "state": state}))
 
+    # GET with consent already on record → skip the screen
+    if prompt != "consent" and _has_consent(cur, user_id, app["id"], scope_mask):
+        conn.close()
+        code = run_write(_issue_code, user_id, app["id"], redirect_uri, scope, scope_mask)
+        record_hit(app["id"], "authorize")
+        return redirect(_add_qs(redirect_uri, {"code": code, "state": state}))
+
     # GET → render consent screen
     conn.close()
     return render_template(
@@ -104,6 +154,7 @@ def token():
     client_id = request.form.get("client_id")
     client_secret = request.form.get("client_secret")
     code = request.form.get("code")
+    redirect_uri = request.form.get("redirect_uri")
     grant_type = request.form.get("grant_type", "authorization_code")
 
     if grant_type != "authorization_code":
@@ -114,41 +165,50 @@ def token():
     cur = conn.cursor()
     cur.execute("SELECT * FROM apps WHERE client_id=? AND client_secret=?", (client_id, client_secret))
     app = cur.fetchone()
+    conn.close()
     if not app:
-        conn.close()
         return jsonify({"error": "invalid_client"}), 400
+    if not code or not redirect_uri:
+        record_hit(app["id"], "error")
+        return jsonify({"error": "invalid_request"}), 400
 
-    # Validate code
-    cur.execute("SELECT * FROM oauth_codes WHERE code=? AND used=0", (code,))
-    code_row = cur.fetchone()
-    if not code_row:
-        conn.close()
-        return jsonify({"error": "invalid_code"}), 400
-
-    user_id = code_row["user_id"]
-
-    # Mark code as used
-    cur.execute("UPDATE oauth_codes SET used=1 WHERE code=?", (code,))
-
-    # Generate tokens
+    # Everything that doesn't need the write lock happens before the job
     access_token = generate_token(32)
     refresh_token = generate_token(32)
-    expires_at = (datetime.utcnow() + timedelta(seconds=3600)).isoformat(timespec="seconds")
-
-    # Insert into oauth_tokens
-    cur.execute("""
-        INSERT INTO oauth_tokens (user_id, app_id, access_token, refresh_token, expires_at)
-        VALUES (?, ?, ?, ?, ?)
-    """, (user_id, app["id"], access_token, refresh_token, expires_at))
-
-    # Log action
-    cur.execute(
-        "INSERT INTO oauth_logs (user_id, app_id, action, timestamp) VALUES (?, ?, ?, ?)",
-        (user_id, app["id"], "token_issued", datetime.utcnow())
-    )
-
-    conn.commit()
-    conn.close()
+    access_hash, refresh_hash = hash_token(access_token), hash_token(refresh_token)
+    now = datetime.utcnow()
+    expires_at = (now + timedelta(seconds=3600)).isoformat(timespec="seconds")
+    code_hash = hash_token(code)
+
+    def exchange(wcur):
+        # Redeem: one statement claims the code only if it is unused, unexpired
+        # and was issued to this client for this redirect_uri. A second
+        # exchange of the same code matches no row.
+        wcur.execute("""
+            UPDATE oauth_codes SET used=1
+            WHERE code_hash=? AND used=0 AND expires_at > ? AND app_id=? AND redirect_uri=?
+            RETURNING user_id, scope_mask
+        """, (code_hash, now.isoformat(timespec="seconds"), app["id"], redirect_uri))
+        code_row = wcur.fetchone()
+        if not code_row:
+            return False
+
+        wcur.execute("""
+            INSERT INTO oauth_tokens (user_id, app_id, access_token_hash, refresh_token_hash, expires_at, scope_mask)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (code_row["user_id"], app["id"], access_hash, refresh_hash, expires_at, code_row["scope_mask"]))
+
+        # Log action
+        wcur.execute(
+            "INSERT INTO oauth_logs (user_id, app_id, action, timestamp) VALUES (?, ?, ?, ?)",
+            (code_row["user_id"], app["id"], "token_issued", now)
+        )
+        return True
+
+    if not run_write(exchange):
+        record_hit(app["id"], "error")
+        return jsonify({"error": "invalid_code"}), 400
+    record_hit(app["id"], "token")
 
     return jsonify({
         "access_token": access_token,
@@ -169,6 +229,12 @@ def revoke():
 
     client_id = request.form.get("client_id")
     user_id = request.form.get("user_id")  # optional
+    if user_id:
+        if not user_id.isdigit():
+            return "Invalid user_id", 400
+        user_id = int(user_id)
+    else:
+        user_id = None
 
     conn = get_db_connection()
     cur = conn.cursor()
@@ -176,21 +242,29 @@ def revoke():
     # Get app
     cur.execute("SELECT * FROM apps WHERE client_id=?", (client_id,))
     app = cur.fetchone()
+    conn.close()
     if not app:
-        conn.close()
         return "Invalid client_id", 400
 
+    def revoke_job(wcur):
+        if user_id is not None:
+            wcur.execute("UPDATE oauth_authorizations SET revoked=1 WHERE app_id=? AND user_id=?", (app["id"], user_id))
+            revoke_grant_tokens(wcur, user_id, app["id"])
+        else:
+            wcur.execute("UPDATE oauth_authorizations SET revoked=1 WHERE app_id=?", (app["id"],))
+            revoke_app_tokens(wcur, app["id"])
+        # user_id null means every grant of the app
+        webhooks.queue_event(wcur, "grant.revoked", {
+            "app_id": app["id"], "user_id": user_id,
+        }, app_id=app["id"])
+        realtime.publish(wcur, "grant_revoked", {
+            "app_id": app["id"], "app_name": app["name"], "user_id": user_id,
+        }, user_ids=[user_id if user_id is not None else app["owner_id"]], admins=True)
+
     # Revoke
-    if user_id:
-        cur.execute("UPDATE oauth_authorizations SET revoked=1 WHERE app_id=? AND user_id=?", (app["id"], user_id))
-    else:
-        cur.execute("UPDATE oauth_authorizations SET revoked=1 WHERE app_id=?", (app["id"],))
-    conn.commit()
-    conn.close()
+    run_write(revoke_job)
 
     return jsonify({"status": "revoked"})
-from flask import Blueprint, render_template, session
-
 
 
 # Existing routes ...
@@ -1,9 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import os
+import threading
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory
 from config import Config
 from db import init_db, get_db_connection
 from utils.auth import register_user, login_user, logout_user, is_admin, is_developer, get_user_by_id, get_user_by_username
 from api.handle_requests import handle_bp
 from utils.security import generate_token
+from utils.revocation import revoke_user_tokens, revoke_app_tokens
+from utils.metering import get_usage
+from utils.backup import start_scheduler as start_backup_scheduler
+from utils import sql_profiler, request_profiler, login_guard, warmup
+from utils.redirect_uris import parse_uri_list, set_redirect_uris, get_redirect_uris
+from utils.mailer import queue_email, start_sender as start_email_sender
+from utils import realtime, webhooks
+from utils.writer import run_write, writer, WriteQueueFull
+from utils.suggestions import list_suggestions, search_suggestions, create_suggestion
 from api.oauth import oauth_bp
 
 # ---------------- App Setup ----------------
@@ -11,9 +22,34 @@ app = Flask(__name__)
 app.config.from_object(Config)
 app.register_blueprint(oauth_bp)
 app.register_blueprint(handle_bp)
-
-# Initialize DB
-init_db()
+sql_profiler.init_app(app)
+request_profiler.init_app(app)
+realtime.init_app(app)
+warmup.init_app(app)
+
+# ---------------- Process Startup ----------------
+# Importing the app touches neither the database nor threads. Migrations and
+# the background senders start on the first request each worker process
+# serves, so `gunicorn --preload` forks clean workers and the import stays
+# cheap. `python -m db` runs the migrations as a deploy step.
+_started_pid = None
+_start_lock = threading.Lock()
+
+def start_services():
+    """Run init_db() and start this process's background threads, once per process."""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        init_db()
+        start_backup_scheduler()
+        start_email_sender()
+        webhooks.start_dispatcher()
+        _started_pid = os.getpid()
+
+app.before_request(start_services)
 
 # ---------------- Routes ----------------
 @app.route("/about")
@@ -67,6 +103,9 @@ def login():
                 return redirect(url_for("login"))
 
             return redirect(url_for("dashboard"))
+        elif login_guard.is_locked(login_guard.normalize(username_or_email)):
+            flash("❌ Too many failed attempts. Please try again later.", "danger")
+            return redirect(url_for("login"))
         else:
             flash("❌ Invalid username/email or password", "danger")
             return redirect(url_for("login"))
@@ -91,11 +130,14 @@ def dashboard():
     # Developer-specific data
     owned_apps = []
     pending_app_requests = []
+    app_usage = {}
 
     if user["role"].lower() == "developer":
         # Fetch apps owned by this developer
         cur.execute("SELECT * FROM apps WHERE owner_id=?", (user["id"],))
         owned_apps = cur.fetchall()
+        # Last 24h traffic per app, read from the hourly rollups
+        app_usage = get_usage([a["id"] for a in owned_apps])
 
         # Check if the developer has a pending app request
         cur.execute("""
@@ -136,6 +178,7 @@ def dashboard():
         "dashboard.html",
         user=user,
         owned_apps=owned_apps,
+        app_usage=app_usage,
         pending_requests=pending_app_requests,
         authorized_apps=authorized_apps,
         has_pending_request=has_pending_request,
@@ -164,19 +207,35 @@ def edit_app(app_id):
         new_name = request.form.get("app_name", "").strip()
         new_redirect = request.form.get("redirect_uri", "").strip()
         new_desc = request.form.get("description", "").strip()
-
-        if new_name and new_redirect:
-            cur.execute("""
-                UPDATE apps SET name=?, redirect_uri=?, description=?
-                WHERE id=?
-            """, (new_name, new_redirect, new_desc, app_id))
-            conn.commit()
+        new_webhook = request.form.get("webhook_url", "").strip() or None
+        webhook_error = webhooks.validate_url(new_webhook) if new_webhook else None
+
+        # One URI or pattern per line
+        registrations, errors = parse_uri_list(new_redirect)
+        if errors:
+            flash(f"❌ Invalid redirect URI: {errors[0]}", "danger")
+        elif webhook_error:
+            flash(f"❌ Invalid webhook URL: {webhook_error}", "danger")
+        elif new_name and registrations:
+            def update(wcur):
+                # apps.redirect_uri keeps the primary URI for display
+                wcur.execute("""
+                    UPDATE apps SET name=?, redirect_uri=?, description=?, webhook_url=?,
+                        webhook_secret=COALESCE(webhook_secret, ?)
+                    WHERE id=?
+                """, (new_name, registrations[0][0], new_desc, new_webhook, generate_token(32), app_id))
+                set_redirect_uris(wcur, app_data["id"], registrations)
+
+            run_write(update)
             flash("✅ App updated successfully.", "success")
             conn.close()
             return redirect(url_for("dashboard"))
 
+    redirect_uris = get_redirect_uris(cur, app_data["id"]) or app_data["redirect_uri"].split()
+    webhook_stats = webhooks.delivery_stats(cur, app_data["id"]) if app_data["webhook_url"] else None
     conn.close()
-    return render_template("edit_app.html", app=app_data, user=user)
+    return render_template("edit_app.html", app=app_data, user=user, redirect_uris=redirect_uris,
+                           webhook_stats=webhook_stats)
 
 # ---------------- Profile ----------------
 @app.route("/profile/<username>")
@@ -232,6 +291,13 @@ def not_found(e):
 @app.errorhandler(403)
 def forbidden(e):
     return "Forbidden", 403
+
+@app.errorhandler(WriteQueueFull)
+def write_queue_full(e):
+    # Shed load instead of letting requests queue behind a saturated writer
+    if request.path.startswith(("/api/", "/oauth/")):
+        return jsonify({"error": "temporarily_unavailable"}), 503, {"Retry-After": "1"}
+    return "Service busy, please retry shortly.", 503, {"Retry-After": "1"}
 @app.route("/app/new", methods=["GET", "POST"])
 def request_app():
     if "user_id" not in session:
@@ -248,15 +314,25 @@ def request_app():
         if not app_name or not redirect_uri:
             flash("❌ Fill all required fields.", "danger")
             return redirect(url_for("request_app"))
+        _, uri_errors = parse_uri_list(redirect_uri)
+        if uri_errors:
+            flash(f"❌ Invalid redirect URI: {uri_errors[0]}", "danger")
+            return redirect(url_for("request_app"))
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO app_requests (user_id, app_name, redirect_uri, description)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, app_name, redirect_uri, description))
-        conn.commit()
-        conn.close()
+        def create(cur):
+            cur.execute("""
+                INSERT INTO app_requests (user_id, app_name, redirect_uri, description)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, app_name, redirect_uri, description))
+            realtime.publish(cur, "app_request_created", {
+                "id": cur.lastrowid,
+                "user_id": user_id,
+                "app_name": app_name,
+                "redirect_uri": redirect_uri,
+                "description": description,
+            }, admins=True)
+
+        run_write(create)
 
         flash("✅ App request submitted. Wait for admin approval.", "success")
         return redirect(url_for("dashboard"))
@@ -311,22 +387,43 @@ def revoke_access():
     user_id = session.get("user_id")
     user = get_user_by_id(user_id)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
     if request.method == "POST":
-        target_user_id = request.form.get("user_id")
-        app_id = request.form.get("app_id")
+        target_user_id = request.form.get("user_id", "")
+        app_id = request.form.get("app_id", "")
         action = request.form.get("action")  # 'user' or 'app'
+        if (action == "user" and not target_user_id.isdigit()) or (action == "app" and not app_id.isdigit()):
+            return "Invalid user_id or app_id", 400
+        target_user_id = int(target_user_id) if action == "user" else None
+        app_id = int(app_id) if action == "app" else None
+
+        def revoke(cur):
+            if action == "user":
+                # Queue first: the recipients are the apps holding grants
+                webhooks.queue_event(cur, "user.revoked", {"user_id": target_user_id}, user_id=target_user_id)
+                cur.execute("DELETE FROM oauth_authorizations WHERE user_id=?", (target_user_id,))
+                revoke_user_tokens(cur, target_user_id)
+                cur.execute("SELECT username FROM users WHERE id=?", (target_user_id,))
+                target = cur.fetchone()
+                if target:
+                    realtime.publish(cur, "user_revoked", {"user_id": target_user_id, "username": target["username"]},
+                                     user_ids=[target_user_id], admins=True)
+            elif action == "app":
+                webhooks.queue_event(cur, "app.revoked", {"app_id": app_id}, app_id=app_id)
+                cur.execute("SELECT name, owner_id FROM apps WHERE id=?", (app_id,))
+                target = cur.fetchone()
+                cur.execute("DELETE FROM apps WHERE id=?", (app_id,))
+                cur.execute("DELETE FROM oauth_authorizations WHERE app_id=?", (app_id,))
+                revoke_app_tokens(cur, app_id)
+                if target:
+                    realtime.publish(cur, "app_revoked", {"app_id": app_id, "app_name": target["name"]},
+                                     user_ids=[target["owner_id"]], admins=True)
+
+        if action in ("user", "app"):
+            run_write(revoke)
+            flash("✅ Access revoked successfully", "success")
 
-        if action == "user" and target_user_id:
-            cur.execute("DELETE FROM oauth_authorizations WHERE user_id=?", (target_user_id,))
-        elif action == "app" and app_id:
-            cur.execute("DELETE FROM apps WHERE id=?", (app_id,))
-            cur.execute("DELETE FROM oauth_authorizations WHERE app_id=?", (app_id,))
-
-        conn.commit()
-        flash("✅ Access revoked successfully", "success")
+    conn = get_db_connection()
+    cur = conn.cursor()
 
     # Fetch all users
     cur.execute("SELECT id, username, email, role FROM users")
@@ -353,25 +450,35 @@ def manage_users():
     user_id = session.get("user_id")
     user = get_user_by_id(user_id)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
     if request.method == "POST":
         target_user_id = request.form.get("user_id")
         new_role = request.form.get("role")  # 'user', 'developer', 'admin'
         action = request.form.get("action")  # optional: 'disable' or 'enable'
 
-        if new_role and target_user_id:
-            cur.execute("UPDATE users SET role=? WHERE id=?", (new_role, target_user_id))
-
-        if action == "disable" and target_user_id:
-            cur.execute("UPDATE users SET is_active=0 WHERE id=?", (target_user_id,))
-        elif action == "enable" and target_user_id:
-            cur.execute("UPDATE users SET is_active=1 WHERE id=?", (target_user_id,))
-
-        conn.commit()
+        def update(cur):
+            if new_role and target_user_id:
+                cur.execute("UPDATE users SET role=? WHERE id=?", (new_role, target_user_id))
+
+            if action == "disable" and target_user_id:
+                cur.execute("UPDATE users SET is_active=0 WHERE id=?", (target_user_id,))
+            elif action == "enable" and target_user_id:
+                cur.execute("UPDATE users SET is_active=1 WHERE id=?", (target_user_id,))
+
+            if target_user_id and (new_role or action in ("disable", "enable")):
+                cur.execute("SELECT id, username, role, is_active FROM users WHERE id=?", (target_user_id,))
+                target = cur.fetchone()
+                if target:
+                    webhooks.queue_event(cur, "user.updated", {
+                        "user_id": target["id"], "username": target["username"],
+                        "role": target["role"], "is_active": bool(target["is_active"]),
+                    }, user_id=target["id"])
+
+        run_write(update)
         flash("✅ User updated successfully", "success")
 
+    conn = get_db_connection()
+    cur = conn.cursor()
+
     cur.execute("SELECT id, username, email, role, is_active FROM users")
     users = cur.fetchall()
     conn.close()
@@ -384,59 +491,69 @@ def approve_app_request(request_id):
     if not is_admin():
         return "Unauthorized", 403
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    def approve(cur):
+        # Fetch the pending request
+        cur.execute("SELECT * FROM app_requests WHERE id=? AND status='pending'", (request_id,))
+        req = cur.fetchone()
+        if not req:
+            return None
+
+        # Generate unique client_id and client_secret
+        client_id = generate_token(20)
+        client_secret = generate_token(40)
+        registrations, _ = parse_uri_list(req["redirect_uri"])
 
-    # Fetch the pending request
-    cur.execute("SELECT * FROM app_requests WHERE id=? AND status='pending'", (request_id,))
-    req = cur.fetchone()
+        # Create the app
+        cur.execute("""
+            INSERT INTO apps (owner_id, name, client_id, client_secret, redirect_uri, description, status)
+            VALUES (?, ?, ?, ?, ?, ?, 'active')
+        """, (
+            req["user_id"],
+            req["app_name"],
+            client_id,
+            client_secret,
+            req["redirect_uri"],
+            req["description"]
+        ))
+        set_redirect_uris(cur, cur.lastrowid, registrations)
+
+        # Mark the request as approved
+        cur.execute("UPDATE app_requests SET status='approved' WHERE id=?", (request_id,))
+        cur.execute("SELECT username, email FROM users WHERE id=?", (req["user_id"],))
+        owner = cur.fetchone()
+        if owner:
+            queue_email(cur, owner["email"], "app_request_approved", username=owner["username"], app_name=req["app_name"])
+        realtime.publish(cur, "app_request_approved", {"id": req["id"], "app_name": req["app_name"]},
+                         user_ids=[req["user_id"]], admins=True)
+        return req
+
+    req = run_write(approve)
     if not req:
         flash("❌ Request not found or already processed.", "danger")
-        conn.close()
         return redirect(url_for("manage_app_requests"))
 
-    # Generate unique client_id and client_secret
-    client_id = generate_token(20)
-    client_secret = generate_token(40)
-
-    # Create the app
-    cur.execute("""
-        INSERT INTO apps (owner_id, name, client_id, client_secret, redirect_uri, description, status)
-        VALUES (?, ?, ?, ?, ?, ?, 'active')
-    """, (
-        req["user_id"],
-        req["app_name"],
-        client_id,
-        client_secret,
-        req["redirect_uri"],
-        req["description"]
-    ))
-
-    # Mark the request as approved
-    cur.execute("UPDATE app_requests SET status='approved' WHERE id=?", (request_id,))
-    conn.commit()
-    conn.close()
-
     flash(f"✅ App '{req['app_name']}' approved and created successfully!", "success")
     return redirect(url_for("manage_app_requests"))
 # ---------------- Set Admin Route ----------------
 @app.route("/set-admin/<user_id>")
 def set_admin(user_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # Make sure the user exists
-    cur.execute("SELECT * FROM users WHERE id=?", (user_id,))
-    user = cur.fetchone()
+    def promote(cur):
+        # Make sure the user exists
+        cur.execute("SELECT * FROM users WHERE id=?", (user_id,))
+        user = cur.fetchone()
+        if user:
+            # Update role to admin
+            cur.execute("UPDATE users SET role='admin' WHERE id=?", (user_id,))
+            webhooks.queue_event(cur, "user.updated", {
+                "user_id": user["id"], "username": user["username"],
+                "role": "admin", "is_active": bool(user["is_active"]),
+            }, user_id=user["id"])
+        return user
+
+    user = run_write(promote)
     if not user:
-        conn.close()
         return f"❌ User with ID {user_id} not found.", 404
 
-    # Update role to admin
-    cur.execute("UPDATE users SET role='admin' WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
-
     return f"✅ User '{user['username']}' is now an admin!"
 
 
@@ -446,13 +563,21 @@ def deny_app_request(request_id):
     if not is_admin():
         return "Unauthorized", 403
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    def deny(cur):
+        # Mark the request as denied
+        cur.execute("UPDATE app_requests SET status='denied' WHERE id=? AND status='pending'", (request_id,))
+        if cur.rowcount:
+            cur.execute("""
+                SELECT r.id, r.user_id, r.app_name, u.username, u.email FROM app_requests r
+                JOIN users u ON u.id = r.user_id
+                WHERE r.id=?
+            """, (request_id,))
+            req = cur.fetchone()
+            queue_email(cur, req["email"], "app_request_denied", username=req["username"], app_name=req["app_name"])
+            realtime.publish(cur, "app_request_denied", {"id": req["id"], "app_name": req["app_name"]},
+                             user_ids=[req["user_id"]], admins=True)
 
-    # Mark the request as denied
-    cur.execute("UPDATE app_requests SET status='denied' WHERE id=? AND status='pending'", (request_id,))
-    conn.commit()
-    conn.close()
+    run_write(deny)
 
     flash("❌ App request denied.", "warning")
     return redirect(url_for("manage_app_requests"))
@@ -462,19 +587,30 @@ def deny_app_request(request_id):
 def revoke_user(user_id):
     if not is_admin():
         return "Unauthorized", 403
-
-    conn = get_db_connection()
-    cur = conn.cursor()
+    if not user_id.isdigit():
+        return "Invalid user_id", 400
+    user_id = int(user_id)
 
     # Prevent revoking yourself
     if session.get("user_id") == user_id:
         flash("❌ You cannot revoke your own account!", "danger")
         return redirect(url_for("revoke_access"))
 
-    # Disable user account (or delete)
-    cur.execute("UPDATE users SET role='revoked' WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    def revoke(cur):
+        # Disable user account (or delete)
+        cur.execute("UPDATE users SET role='revoked' WHERE id=?", (user_id,))
+        # Kill already-issued tokens with one epoch row instead of a mass UPDATE
+        revoke_user_tokens(cur, user_id)
+        cur.execute("SELECT username, email FROM users WHERE id=?", (user_id,))
+        target = cur.fetchone()
+        if target:
+            queue_email(cur, target["email"], "user_revoked", username=target["username"])
+            realtime.publish(cur, "user_revoked", {"user_id": user_id, "username": target["username"]},
+                             user_ids=[user_id], admins=True)
+            webhooks.queue_event(cur, "user.revoked", {"user_id": user_id, "username": target["username"]},
+                                 user_id=user_id)
+
+    run_write(revoke)
 
     flash("✅ User access revoked successfully", "success")
     return redirect(url_for("revoke_access"))
@@ -485,21 +621,142 @@ def revoke_user(user_id):
 def revoke_app(app_id):
     if not is_admin():
         return "Unauthorized", 403
+    if not app_id.isdigit():
+        return "Invalid app_id", 400
+    app_id = int(app_id)
+
+    def revoke(cur):
+        cur.execute("""
+            SELECT a.name, a.owner_id, u.username, u.email FROM apps a
+            JOIN users u ON u.id = a.owner_id
+            WHERE a.id=?
+        """, (app_id,))
+        target = cur.fetchone()
+        # Queue before the delete: the event copies the app's webhook URL
+        webhooks.queue_event(cur, "app.revoked", {"app_id": app_id}, app_id=app_id)
+
+        # Option 1: Soft delete (mark app as revoked)
+        #cur.execute("UPDATE apps SET status='pending' WHERE id=?", (app_id,))
+        # Option 2: Hard delete
+        cur.execute("DELETE FROM apps WHERE id=?", (app_id,))
+        # Tokens outlive the app row, so stamp an epoch for them
+        revoke_app_tokens(cur, app_id)
+        if target:
+            queue_email(cur, target["email"], "app_revoked", username=target["username"], app_name=target["name"])
+            realtime.publish(cur, "app_revoked", {"app_id": app_id, "app_name": target["name"]},
+                             user_ids=[target["owner_id"]], admins=True)
+
+    run_write(revoke)
+
+    flash("✅ App access revoked successfully", "success")
+    return redirect(url_for("revoke_access"))
+
+# ---------------- Suggestions ----------------
+@app.route("/suggestions", methods=["GET", "POST"])
+def suggestions():
+    if request.method == "POST":
+        if "user_id" not in session:
+            flash("❌ Please log in first.", "danger")
+            return redirect(url_for("login"))
+        try:
+            run_write(create_suggestion, session["user_id"], request.form.get("title"), request.form.get("content"))
+            flash("✅ Thanks for your suggestion!", "success")
+        except ValueError as e:
+            flash(f"❌ {e}", "danger")
+        return redirect(url_for("suggestions"))
+
+    q = request.args.get("q", "").strip()
+    cursor = request.args.get("cursor") or None
+    user_id = request.args.get("user_id", type=int)
 
     conn = get_db_connection()
     cur = conn.cursor()
-
-    # Option 1: Soft delete (mark app as revoked)
-    #cur.execute("UPDATE apps SET status='pending' WHERE id=?", (app_id,))
-    # Option 2: Hard delete
-    cur.execute("DELETE FROM apps WHERE id=?", (app_id,))
-    
-    conn.commit()
+    try:
+        page = search_suggestions(cur, q, cursor=cursor) if q else list_suggestions(cur, cursor=cursor, user_id=user_id)
+    except ValueError:
+        conn.close()
+        return redirect(url_for("suggestions"))
     conn.close()
 
-    flash("✅ App access revoked successfully", "success")
-    return redirect(url_for("revoke_access"))
+    return render_template("suggestions.html", page=page, q=q, user_id=user_id)
+
+# ---------------- SQL Profiler ----------------
+@app.route("/admin/sql-profiler", methods=["GET", "POST"])
+def sql_profiler_admin():
+    """
+    GET: aggregated statement stats for this worker.
+    POST action=enable|disable|reset (optional slow_ms, budget).
+    """
+    if not is_admin():
+        return "Unauthorized", 403
+
+    if request.method == "POST":
+        action = request.form.get("action")
+        if action == "enable":
+            sql_profiler.enable(
+                slow_ms=request.form.get("slow_ms", type=float),
+                budget=request.form.get("budget", type=int)
+            )
+        elif action == "disable":
+            sql_profiler.disable()
+        elif action == "reset":
+            sql_profiler.reset()
+
+    return jsonify({
+        "enabled": sql_profiler.enabled,
+        "slow_query_ms": sql_profiler.slow_query_ms,
+        "request_query_budget": sql_profiler.request_query_budget,
+        "statements": sql_profiler.get_stats(request.args.get("limit", 50, type=int)),
+    })
+
+# ---------------- Request Profiler ----------------
+@app.route("/admin/profiler", methods=["GET", "POST"])
+def request_profiler_admin():
+    """
+    GET: recent request profiles for this worker.
+    POST action=enable|disable|reset (optional rate, mode, interval_ms).
+    """
+    if not is_admin():
+        return "Unauthorized", 403
+
+    if request.method == "POST":
+        action = request.form.get("action")
+        if action == "enable":
+            request_profiler.enable(
+                rate=request.form.get("rate", type=float),
+                new_mode=request.form.get("mode"),
+                interval=request.form.get("interval_ms", type=float)
+            )
+        elif action == "disable":
+            request_profiler.disable()
+        elif action == "reset":
+            request_profiler.reset()
+        return redirect(url_for("request_profiler_admin"))
+
+    return render_template(
+        "admin_profiler.html",
+        user=get_user_by_id(session.get("user_id")),
+        profiler=request_profiler,
+        profiles=request_profiler.recent_profiles(),
+        top_stacks=request_profiler.top_stacks(),
+        header=request_profiler.HEADER,
+        token=request_profiler.make_token() if request_profiler.enabled else None
+    )
+
+@app.route("/admin/profiler/files/<path:name>")
+def request_profiler_file(name):
+    if not is_admin():
+        return "Unauthorized", 403
+    return send_from_directory(os.path.abspath(request_profiler.profile_dir()), name, as_attachment=True)
+
+# ---------------- Write Queue Metrics ----------------
+@app.route("/admin/metrics/writer")
+def writer_metrics():
+    if not is_admin():
+        return "Unauthorized", 403
+    return jsonify(writer.metrics())
 
 # ---------------- Run ----------------
 if __name__ == "__main__":
-    app.run(host='0.0.0.0',port=81)
+    start_services()
+    realtime.socketio.run(app, host='0.0.0.0', port=81)
@@ -2,8 +2,9 @@ import os
 from datetime import timedelta
 from dotenv import load_dotenv
 
-# Load environment variables from .env
-load_dotenv()
+# Load environment variables from .env next to this file; an explicit path
+# skips find_dotenv()'s walk up from the caller's stack frame
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
 
 # ---------------- General Flask Settings ----------------
 class Config:
@@ -16,15 +17,60 @@ class Config:
     # ---------------- Database ----------------
     DB_FILE = os.getenv("stybase_DB", "stybase.db")
     DATABASE_URI = f"sqlite:///{DB_FILE}"
+    DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", 10))  # seconds to wait for the write lock
+
+    # ---------------- Write Coordinator ----------------
+    WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", 1000))  # pending jobs before backpressure
+    WRITE_QUEUE_TIMEOUT = float(os.getenv("WRITE_QUEUE_TIMEOUT", 2))  # seconds to wait for a slot
+    WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 64))  # jobs per group commit
+    WRITE_RESULT_TIMEOUT = float(os.getenv("WRITE_RESULT_TIMEOUT", 30))  # seconds to wait for a job's commit
+
+    # ---------------- Backups ----------------
+    BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+    BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", 0))  # seconds, 0 = no scheduled backups
+    BACKUP_RETENTION = int(os.getenv("BACKUP_RETENTION", 7))  # snapshots to keep
+    BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", 256))
+    BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", 0.05))  # seconds between steps
+    REPORTING_SNAPSHOT = os.getenv("REPORTING_SNAPSHOT", "backups/reporting.db")
 
     # ---------------- OAuth Settings ----------------
     OAUTH_TOKEN_EXPIRY = int(os.getenv("OAUTH_TOKEN_EXPIRY", 3600))
     OAUTH_REFRESH_EXPIRY = int(os.getenv("OAUTH_REFRESH_EXPIRY", 86400))
-    OAUTH_SCOPES = os.getenv("OAUTH_SCOPES", "profile,email,openid").split(",")
+    OAUTH_SCOPES = os.getenv("OAUTH_SCOPES", "profile,email,openid,app_password").split(",")  # requestable; bits are fixed in utils.scopes
+    REVOCATION_CACHE_SIZE = int(os.getenv("REVOCATION_CACHE_SIZE", 10000))  # cached (user, app) cutoffs per worker
+
+    # ---------------- Logging / Profiling ----------------
+    LOG_DIR = os.getenv("LOG_DIR", "logs")
+    SQL_PROFILER_ENABLED = os.getenv("SQL_PROFILER_ENABLED", "False").lower() in ["true", "1", "yes"]
+    SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", 50))
+    SQL_REQUEST_QUERY_BUDGET = int(os.getenv("SQL_REQUEST_QUERY_BUDGET", 20))  # queries per request
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "False").lower() in ["true", "1", "yes"]
+    PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", 0.01))  # fraction of requests profiled
+    PROFILER_MODE = os.getenv("PROFILER_MODE", "sampler")  # sampler or cprofile
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 5))  # stack sampling period
+    PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", 200))  # per-request profile files kept
+
+    # ---------------- Templates ----------------
+    TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "cache/templates")  # shared Jinja bytecode cache, "" = off
+    TEMPLATE_PRECOMPILE = os.getenv("TEMPLATE_PRECOMPILE", "False").lower() in ["true", "1", "yes"]  # compile all at import
+
+    # ---------------- Usage Metering ----------------
+    METERING_FLUSH_INTERVAL = int(os.getenv("METERING_FLUSH_INTERVAL", 60))  # seconds
+
+    # ---------------- Suggestions Feed ----------------
+    SUGGESTIONS_PAGE_SIZE = int(os.getenv("SUGGESTIONS_PAGE_SIZE", 20))
+    SUGGESTIONS_MAX_PAGE = int(os.getenv("SUGGESTIONS_MAX_PAGE", 100))  # largest ?limit= accepted
+    SUGGESTIONS_CACHE_SIZE = int(os.getenv("SUGGESTIONS_CACHE_SIZE", 1024))  # cached first pages per worker
 
     # ---------------- Password / Security ----------------
     PASSWORD_HASH_ALGORITHM = os.getenv("PASSWORD_HASH_ALGORITHM", "sha256")
     PASSWORD_SALT_ROUNDS = int(os.getenv("PASSWORD_SALT_ROUNDS", 12))
+    LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", 5))  # failed logins before lockout
+    LOGIN_FAILURE_WINDOW = int(os.getenv("LOGIN_FAILURE_WINDOW", 900))  # seconds failures are counted over
+    LOGIN_LOCKOUT_SECONDS = int(os.getenv("LOGIN_LOCKOUT_SECONDS", 900))
+    LOGIN_TRACKED_IDENTIFIERS = int(os.getenv("LOGIN_TRACKED_IDENTIFIERS", 100_000))  # failure counters per worker
+    LOGIN_FILTER_CAPACITY = int(os.getenv("LOGIN_FILTER_CAPACITY", 1_000_000))  # identifiers before the filter grows
+    LOGIN_FILTER_REFRESH = float(os.getenv("LOGIN_FILTER_REFRESH", 1.0))  # seconds between catch-up reads
 
     # ---------------- Email Settings ----------------
     EMAIL_ENABLED = os.getenv("EMAIL_ENABLED", "False").lower() in ["true", "1", "yes"]
@@ -33,6 +79,26 @@ class Config:
     EMAIL_USERNAME = os.getenv("EMAIL_USERNAME", "")
     EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
     EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "True").lower() in ["true", "1", "yes"]
+    EMAIL_FROM = os.getenv("EMAIL_FROM", "Stybase <no-reply@stybase.io>")
+    EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", 50))  # messages per SMTP session batch
+    EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 6))
+    EMAIL_RETRY_BASE = int(os.getenv("EMAIL_RETRY_BASE", 30))  # seconds, doubled per attempt
+    EMAIL_POLL_INTERVAL = int(os.getenv("EMAIL_POLL_INTERVAL", 10))  # seconds
+
+    # ---------------- Webhooks ----------------
+    WEBHOOKS_ENABLED = os.getenv("WEBHOOKS_ENABLED", "True").lower() in ["true", "1", "yes"]
+    WEBHOOK_CLAIM_SIZE = int(os.getenv("WEBHOOK_CLAIM_SIZE", 500))  # events claimed per dispatcher round
+    WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 100))  # events per POST
+    WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", 10))  # seconds
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 10))
+    WEBHOOK_RETRY_BASE = int(os.getenv("WEBHOOK_RETRY_BASE", 30))  # seconds, doubled per attempt
+    WEBHOOK_POLL_INTERVAL = int(os.getenv("WEBHOOK_POLL_INTERVAL", 5))  # seconds
+    WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", 7))  # delivered events kept
+    # Development only: also allow http://localhost endpoints (utils.webhooks local receiver)
+    WEBHOOK_ALLOW_LOCALHOST = os.getenv("WEBHOOK_ALLOW_LOCALHOST", "False").lower() in ["true", "1", "yes"]
+
+    # ---------------- Realtime Notifications ----------------
+    REALTIME_POLL_INTERVAL = float(os.getenv("REALTIME_POLL_INTERVAL", 1.0))  # seconds
 
     # ---------------- App URLs ----------------
     BASE_URL = os.getenv("BASE_URL", "http://localhost:5000")
@@ -1,16 +1,49 @@
 import sqlite3
 from datetime import datetime
+from config import Config
+from utils import sql_profiler
+from utils.security import hash_token
+from utils.redirect_uris import migrate_legacy_uris
+from utils.scopes import SCOPE_BITS
 
 DB_FILE = "stybase.db"
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
+    # Wait for the write lock instead of failing with "database is locked"
+    if sql_profiler.enabled:
+        conn = sqlite3.connect(DB_FILE, timeout=Config.DB_BUSY_TIMEOUT, factory=sql_profiler.ProfiledConnection)
+    else:
+        conn = sqlite3.connect(DB_FILE, timeout=Config.DB_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
     return conn
 
+def _add_column(c, table, column, ddl):
+    """ALTER TABLE ADD COLUMN unless the column already exists. Returns True if added."""
+    c.execute(f"PRAGMA table_info({table})")
+    if column in [col["name"] for col in c.fetchall()]:
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return True
+
+def _hash_column(c, table, old, new):
+    """
+    Migrate a plaintext token column to its SHA-256 digest: rename it, then
+    rewrite every row that still holds TEXT. Returns True if migrated.
+    """
+    c.execute(f"PRAGMA table_info({table})")
+    if old not in [col["name"] for col in c.fetchall()]:
+        return False
+    c.execute(f"ALTER TABLE {table} RENAME COLUMN {old} TO {new}")
+    c.execute(f"UPDATE {table} SET {new}=hash_token({new}) WHERE typeof({new})='text'")
+    return True
+
 def init_db():
     conn = get_db_connection()
+    conn.create_function("hash_token", 1, hash_token, deterministic=True)
     c = conn.cursor()
+    # WAL lets readers (and online backups) run alongside the writer; it is
+    # persistent, so setting it once per startup is enough.
+    c.execute("PRAGMA journal_mode=WAL;")
 
     # ---------------- Users ----------------
     c.execute('''
@@ -27,6 +60,42 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     ''')
+    # Login resolves a username or email with one primary-key probe here, instead
+    # of `username=? OR email=?`. Identifiers are stored lowercased (SQLite
+    # lower(), ASCII only), which also makes them unique case-insensitively.
+    c.execute("SELECT 1 FROM sqlite_master WHERE name='login_identifiers'")
+    backfill = c.fetchone() is None
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS login_identifiers (
+            identifier TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        ) WITHOUT ROWID;
+    ''')
+    if backfill:
+        # Existing rows that only differ by case keep the oldest account
+        c.execute('''
+            INSERT OR IGNORE INTO login_identifiers (identifier, user_id)
+            SELECT lower(username), id FROM users
+            UNION ALL
+            SELECT lower(email), id FROM users
+            ORDER BY 2
+        ''')
+    for trigger in (
+        '''CREATE TRIGGER IF NOT EXISTS login_identifiers_ai AFTER INSERT ON users BEGIN
+            INSERT INTO login_identifiers (identifier, user_id)
+            SELECT lower(new.username), new.id UNION SELECT lower(new.email), new.id;
+        END;''',
+        '''CREATE TRIGGER IF NOT EXISTS login_identifiers_ad AFTER DELETE ON users BEGIN
+            DELETE FROM login_identifiers WHERE user_id = old.id;
+        END;''',
+        '''CREATE TRIGGER IF NOT EXISTS login_identifiers_au AFTER UPDATE OF username, email ON users BEGIN
+            DELETE FROM login_identifiers WHERE user_id = old.id;
+            INSERT INTO login_identifiers (identifier, user_id)
+            SELECT lower(new.username), new.id UNION SELECT lower(new.email), new.id;
+        END;''',
+    ):
+        c.execute(trigger)
     # --------------------------- app requests -------------------------------------
     c.execute('''CREATE TABLE IF NOT EXISTS app_requests (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -56,6 +125,9 @@ def init_db():
         FOREIGN KEY(owner_id) REFERENCES users(id)
     );
     ''')
+    # Revocation webhooks (utils.webhooks); NULL url means none registered
+    _add_column(c, "apps", "webhook_url", "TEXT")
+    _add_column(c, "apps", "webhook_secret", "TEXT")
 
     #
     # ---------------- OAuth Authorizations ----------------
@@ -64,20 +136,35 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             app_id INTEGER NOT NULL,
+            scope TEXT NOT NULL DEFAULT '',  -- normalized: sorted, space separated
             authorized_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             revoked INTEGER DEFAULT 0,
             FOREIGN KEY(user_id) REFERENCES users(id),
             FOREIGN KEY(app_id) REFERENCES apps(id)
         );
     ''')
+    # Older databases: add scope, collapse duplicate approvals, then enforce one row per grant
+    if _add_column(c, "oauth_authorizations", "scope", "TEXT NOT NULL DEFAULT ''"):
+        c.execute('''
+            DELETE FROM oauth_authorizations WHERE id NOT IN (
+                SELECT MAX(id) FROM oauth_authorizations GROUP BY user_id, app_id, scope
+            )
+        ''')
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_oauth_authorizations_grant
+                 ON oauth_authorizations(user_id, app_id, scope);''')
+    if _add_column(c, "oauth_authorizations", "scope_mask", "INTEGER NOT NULL DEFAULT 0"):
+        c.execute("SELECT DISTINCT scope FROM oauth_authorizations WHERE scope != ''")
+        for row in c.fetchall():
+            mask = sum(SCOPE_BITS.get(name, 0) for name in row["scope"].split())
+            c.execute("UPDATE oauth_authorizations SET scope_mask=? WHERE scope=?", (mask, row["scope"]))
     # ---------------- OAuth Tokens ----------------
     c.execute('''
     CREATE TABLE IF NOT EXISTS oauth_tokens (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
         app_id INTEGER NOT NULL,
-        access_token TEXT UNIQUE NOT NULL,
-        refresh_token TEXT UNIQUE,
+        access_token_hash BLOB UNIQUE NOT NULL,  -- SHA-256 of the token (utils.security.hash_token)
+        refresh_token_hash BLOB UNIQUE,
         expires_at TIMESTAMP NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         revoked INTEGER DEFAULT 0,
@@ -85,6 +172,11 @@ def init_db():
         FOREIGN KEY(app_id) REFERENCES apps(id)
     );
 ''')
+    # Granted scope bits (utils.scopes); NULL for tokens issued before scopes were stored
+    _add_column(c, "oauth_tokens", "scope_mask", "INTEGER")
+    # Older databases kept tokens in plaintext
+    _hash_column(c, "oauth_tokens", "access_token", "access_token_hash")
+    _hash_column(c, "oauth_tokens", "refresh_token", "refresh_token_hash")
 
 
     # ---------------- OAuth Access Logs ----------------
@@ -111,6 +203,38 @@ def init_db():
             FOREIGN KEY(user_id) REFERENCES users(id)
         );
     ''')
+    # Keyset pagination walks (created_at, id) newest first, globally and per user
+    c.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_created ON suggestions(created_at, id);')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_user ON suggestions(user_id, created_at, id);')
+    # Full-text index over title/content, kept in sync by triggers
+    c.execute("SELECT 1 FROM sqlite_master WHERE name='suggestions_fts'")
+    if c.fetchone() is None:
+        try:
+            c.execute('''
+                CREATE VIRTUAL TABLE suggestions_fts USING fts5(
+                    title, content, content='suggestions', content_rowid='id'
+                );
+            ''')
+            c.execute("INSERT INTO suggestions_fts(suggestions_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 unavailable, suggestion search falls back to LIKE: {e}")
+    c.execute("SELECT 1 FROM sqlite_master WHERE name='suggestions_fts'")
+    if c.fetchone() is not None:
+        for trigger in (
+            '''CREATE TRIGGER IF NOT EXISTS suggestions_fts_ai AFTER INSERT ON suggestions BEGIN
+                INSERT INTO suggestions_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+            END;''',
+            '''CREATE TRIGGER IF NOT EXISTS suggestions_fts_ad AFTER DELETE ON suggestions BEGIN
+                INSERT INTO suggestions_fts(suggestions_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, old.content);
+            END;''',
+            '''CREATE TRIGGER IF NOT EXISTS suggestions_fts_au AFTER UPDATE ON suggestions BEGIN
+                INSERT INTO suggestions_fts(suggestions_fts, rowid, title, content)
+                VALUES ('delete', old.id, old.title, old.content);
+                INSERT INTO suggestions_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+            END;''',
+        ):
+            c.execute(trigger)
 
     # ---------------- Admin Notes / Optional Future Features ----------------
     c.execute('''
@@ -125,7 +249,7 @@ def init_db():
     #------------------------oauth_codes___________________ 
     c.execute('''CREATE TABLE IF NOT EXISTS oauth_codes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    code TEXT UNIQUE NOT NULL,
+    code_hash BLOB UNIQUE NOT NULL,  -- SHA-256 of the code
     user_id INTEGER NOT NULL,
     app_id INTEGER NOT NULL,
     redirect_uri TEXT NOT NULL,
@@ -133,8 +257,110 @@ def init_db():
     expires_at DATETIME NOT NULL,
     used INTEGER DEFAULT 0
 );''')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_oauth_codes_code ON oauth_codes(code);')
+    _add_column(c, "oauth_codes", "scope_mask", "INTEGER NOT NULL DEFAULT 0")
+    _hash_column(c, "oauth_codes", "code", "code_hash")
+    # Duplicated the UNIQUE constraint's own index
+    c.execute('DROP INDEX IF EXISTS idx_oauth_codes_code;')
+
+    # ---------------- Token Revocation Epochs ----------------
+    # 0 is a wildcard: (user, 0) = whole user, (0, app) = whole app
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            user_id INTEGER NOT NULL DEFAULT 0,
+            app_id INTEGER NOT NULL DEFAULT 0,
+            revoked_before TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, app_id)
+        );
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_token_revocations_app ON token_revocations(app_id, user_id);')
+    # Older databases compared timestamps, which are second-granular; carry
+    # each epoch over as the last token id created at or before it
+    if _add_column(c, "token_revocations", "token_id_cutoff", "INTEGER NOT NULL DEFAULT 0"):
+        c.execute('''
+            UPDATE token_revocations SET token_id_cutoff = COALESCE(
+                (SELECT MAX(t.id) FROM oauth_tokens t WHERE t.created_at <= token_revocations.revoked_before), 0)
+        ''')
+    if _add_column(c, "token_revocations", "generation", "INTEGER NOT NULL DEFAULT 0"):
+        c.execute("UPDATE token_revocations SET generation = rowid")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_token_revocations_generation ON token_revocations(generation);')
+
+    # ---------------- App Usage Rollups ----------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS app_usage_hourly (
+            app_id INTEGER NOT NULL,
+            hour TIMESTAMP NOT NULL,   -- UTC, truncated to the hour
+            event TEXT NOT NULL,       -- authorize, token, userinfo, error
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (app_id, hour, event)
+        );
+    ''')
+
+    # ---------------- App Redirect URIs ----------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS app_redirect_uris (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            app_id INTEGER NOT NULL,
+            uri TEXT NOT NULL,              -- normalized URI or pattern
+            is_pattern INTEGER DEFAULT 0,   -- 1 for *.host or /path/* patterns
+            UNIQUE(app_id, uri),
+            FOREIGN KEY(app_id) REFERENCES apps(id)
+        );
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_app_redirect_uris_app ON app_redirect_uris(app_id);')
+    migrate_legacy_uris(c)
+
+    # ---------------- Email Outbox ----------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_addr TEXT NOT NULL,
+            template TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending, sending, sent, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        );
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at);')
+
+    # ---------------- Webhook Events ----------------
+    # url/secret are copied from the app at queue time so events about a
+    # deleted app can still be delivered
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            app_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            secret TEXT NOT NULL,
+            event TEXT NOT NULL,     -- user.revoked, user.updated, grant.revoked, app.revoked
+            payload TEXT NOT NULL,   -- JSON
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending, sending, delivered, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP
+        );
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_webhook_events_due ON webhook_events(status, next_attempt_at);')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_webhook_events_app ON webhook_events(app_id, status);')
 
+    # ---------------- Realtime Events (short-lived relay log) ----------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS realtime_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT NOT NULL,      -- admins, user:<id>
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,   -- JSON
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
 
     conn.commit()
     conn.close()
@@ -0,0 +1,67 @@
+// realtime.js - live admin/developer notifications over Socket.IO
+
+document.addEventListener("DOMContentLoaded", () => {
+    if (typeof io === "undefined") return;
+    const socket = io();
+
+    // ---------------- Alerts ----------------
+    const flashContainer = document.querySelector(".container.mt-3");
+    function notify(message, category) {
+        if (!flashContainer) return;
+        const alert = document.createElement("div");
+        alert.className = `alert alert-${category} alert-dismissible fade show`;
+        alert.setAttribute("role", "alert");
+        alert.textContent = message;
+        const close = document.createElement("button");
+        close.type = "button";
+        close.className = "btn-close";
+        close.setAttribute("data-bs-dismiss", "alert");
+        alert.appendChild(close);
+        flashContainer.appendChild(alert);
+    }
+
+    function removeRequestRow(id) {
+        const row = document.querySelector(`[data-request-id="${id}"]`);
+        if (row) row.remove();
+    }
+
+    // ---------------- Admin: app request queue ----------------
+    socket.on("app_request_created", (req) => {
+        notify(`📥 New app request: ${req.app_name}`, "info");
+        const tbody = document.getElementById("app-requests-body");
+        if (!tbody) return;
+        const row = document.createElement("tr");
+        row.dataset.requestId = req.id;
+        for (const value of [req.id, req.user_id, req.app_name, req.redirect_uri, req.description]) {
+            const cell = document.createElement("td");
+            cell.textContent = value ?? "";
+            row.appendChild(cell);
+        }
+        const actions = document.createElement("td");
+        actions.innerHTML = `
+            <a href="/admin/manage/app-requests/${req.id}/approve" class="btn btn-success btn-sm">Approve</a>
+            <a href="/admin/manage/app-requests/${req.id}/deny" class="btn btn-danger btn-sm">Deny</a>`;
+        row.appendChild(actions);
+        tbody.appendChild(row);
+    });
+
+    // ---------------- Request decisions ----------------
+    socket.on("app_request_approved", (req) => {
+        removeRequestRow(req.id);
+        notify(`✅ App '${req.app_name}' was approved.`, "success");
+        const pending = document.getElementById("pending-request-status");
+        if (pending) pending.textContent = `Your request for "${req.app_name}" was approved. Reload to see your new app.`;
+    });
+
+    socket.on("app_request_denied", (req) => {
+        removeRequestRow(req.id);
+        notify(`❌ App '${req.app_name}' was denied.`, "warning");
+        const pending = document.getElementById("pending-request-status");
+        if (pending) pending.textContent = `Your request for "${req.app_name}" was denied.`;
+    });
+
+    // ---------------- Revocations ----------------
+    socket.on("user_revoked", (evt) => notify(`🚫 User ${evt.username} was revoked.`, "danger"));
+    socket.on("app_revoked", (evt) => notify(`🚫 App '${evt.app_name}' was revoked.`, "danger"));
+    socket.on("grant_revoked", (evt) => notify(`🚫 Access for app '${evt.app_name}' was revoked.`, "danger"));
+});
@@ -1,39 +1,57 @@
+import sqlite3
 from flask import session, redirect, url_for
 from utils.security import hash_password, verify_password
 from db import get_db_connection
+from utils.mailer import queue_email
+from utils.writer import run_write
+from utils import login_guard
 
 # ---------------- User Registration ----------------
 def register_user(username : str, email: str, app_password : str ,password: str, name=None, phone=None, role="user",):
-    conn = get_db_connection()
-    cur = conn.cursor()
     hashed_pwd = hash_password(password)
-    try:
+
+    def insert(cur):
         cur.execute(
             "INSERT INTO users (username, email, password, name, phone, role, app_password) VALUES (?,?, ?, ?, ?, ?, ?)",
             (username, email, hashed_pwd, name, phone, role,app_password)
         )
-        conn.commit()
         user_id = cur.lastrowid
-    except Exception as e:
-        conn.close()
+        queue_email(cur, email, "registration", username=username)
+        return user_id
+
+    try:
+        user_id = run_write(insert)
+    except sqlite3.Error as e:
+        if "login_identifiers" in str(e):
+            return None, "username or email already in use"
         return None, str(e)
-    conn.close()
+    login_guard.add(username, email)
     return user_id, None
 
 # ---------------- User Login ----------------
+# Usernames and emails match case-insensitively. Unknown and locked-out
+# identifiers are rejected in memory (see utils.login_guard).
 def login_user(username_or_email, password):
+    identifier = login_guard.normalize(username_or_email)
+    if login_guard.is_locked(identifier) or not login_guard.might_exist(identifier):
+        return False, None
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username=? OR email=?", (username_or_email, username_or_email))
+    cur.execute(
+        "SELECT u.* FROM login_identifiers li JOIN users u ON u.id = li.user_id WHERE li.identifier = ?",
+        (identifier,)
+    )
     user = cur.fetchone()
     conn.close()
-    if user and verify_password(password, user["password"]):
-        session["user_id"] = user["id"]
-        session["username"] = user["username"]
-        session["role"] = user["role"]
-        session.permanent = True
-        return True, user
-    return False, None
+    if not user or not verify_password(password, user["password"]):
+        login_guard.record_failure(identifier)
+        return False, None
+    login_guard.record_success(identifier)
+    session["user_id"] = user["id"]
+    session["username"] = user["username"]
+    session["role"] = user["role"]
+    session.permanent = True
+    return True, user
 
 # ---------------- Logout ----------------
 def logout_user():
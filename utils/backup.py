@@ -0,0 +1,222 @@
+import fcntl
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from config import Config
+import db
+
+# ---------------- Online Backup ----------------
+# Copies run through sqlite3.Connection.backup in small page batches with a
+# pause between batches. In WAL mode the source connection pins one read
+# transaction for the whole copy: the snapshot stays consistent, writers keep
+# committing to the WAL, and the backup is never restarted by their changes.
+
+SNAPSHOT_PREFIX = "stybase-"
+
+def _copy(src_path: str, dest_path: str, pages=None, pause=None):
+    pages = pages or Config.BACKUP_PAGES_PER_STEP
+    pause = Config.BACKUP_STEP_SLEEP if pause is None else pause
+
+    def _progress(status, remaining, total):
+        if remaining:
+            time.sleep(pause)
+
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dest = sqlite3.connect(dest_path)
+    try:
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dest, pages=pages, progress=_progress)
+        if wal:
+            src.execute("COMMIT")
+        # The copy inherits WAL mode from the source; switch it back so the
+        # snapshot is one self-contained file with no -wal/-shm sidecars
+        dest.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest.close()
+        src.close()
+
+def _remove_sidecars(path: str):
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def integrity_check(path: str) -> bool:
+    """Run PRAGMA integrity_check on a database file (opened read-only)."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("PRAGMA integrity_check").fetchone()
+    finally:
+        conn.close()
+    return row is not None and row[0] == "ok"
+
+def list_backups(backup_dir=None):
+    """Snapshot paths in the backup directory, newest first."""
+    backup_dir = backup_dir or Config.BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir) if n.startswith(SNAPSHOT_PREFIX) and n.endswith(".db")]
+    return [os.path.join(backup_dir, n) for n in sorted(names, reverse=True)]
+
+def prune_backups(keep=None, backup_dir=None):
+    """Delete all but the newest `keep` snapshots. Returns the removed paths."""
+    keep = Config.BACKUP_RETENTION if keep is None else keep
+    removed = list_backups(backup_dir)[keep:]
+    for path in removed:
+        os.remove(path)
+        _remove_sidecars(path)
+    return removed
+
+def backup_database(backup_dir=None, keep=None):
+    """
+    Take a hot backup of the live database into the backup directory,
+    verify it and apply retention.
+    Returns the snapshot path, or raises RuntimeError if the copy is corrupt.
+    """
+    backup_dir = backup_dir or Config.BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.db"
+    path = os.path.join(backup_dir, name)
+    tmp_path = path + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    _copy(db.DB_FILE, tmp_path)
+    if not integrity_check(tmp_path):
+        os.remove(tmp_path)
+        raise RuntimeError(f"Integrity check failed for backup {path}")
+    _remove_sidecars(tmp_path)
+    os.replace(tmp_path, path)
+
+    prune_backups(keep, backup_dir)
+    return path
+
+def restore_database(snapshot_path: str):
+    """
+    Restore the live database from a snapshot.
+    The snapshot is verified first; the restore holds the write lock while it
+    runs, so do this in a maintenance window.
+    """
+    if not integrity_check(snapshot_path):
+        raise RuntimeError(f"Refusing to restore from corrupt snapshot {snapshot_path}")
+    src = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    dest = sqlite3.connect(db.DB_FILE)
+    try:
+        src.backup(dest)
+    finally:
+        dest.close()
+        src.close()
+
+# ---------------- Reporting Snapshot ----------------
+def export_snapshot(path=None):
+    """
+    Refresh the read-only reporting snapshot. The new copy is written beside
+    the old one and swapped in atomically, so readers never see a partial file.
+    """
+    path = path or Config.REPORTING_SNAPSHOT
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    _copy(db.DB_FILE, tmp_path)
+    if not integrity_check(tmp_path):
+        os.remove(tmp_path)
+        raise RuntimeError(f"Integrity check failed for snapshot {path}")
+    _remove_sidecars(tmp_path)
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, path)
+    _remove_sidecars(path)
+    return path
+
+def get_snapshot_connection(path=None):
+    """Open the reporting snapshot read-only, for reporting jobs."""
+    conn = sqlite3.connect(f"file:{path or Config.REPORTING_SNAPSHOT}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+# ---------------- Scheduler ----------------
+# Every worker process starts a scheduler thread, but only the one holding an
+# exclusive lock on BACKUP_DIR/scheduler.lock takes backups. The lock is kept
+# for the life of the process and released by the OS when it exits, so
+# another worker takes over at its next tick.
+_scheduler = None
+_lock_file = None
+
+def _elect():
+    """True if this process runs the scheduled backups."""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+    f = open(os.path.join(Config.BACKUP_DIR, "scheduler.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+def _backup_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            if not _elect():
+                continue
+            backup_database()
+            export_snapshot()
+        except Exception as e:
+            print(f"Scheduled backup failed: {e}")
+
+def start_scheduler(interval=None):
+    """Start periodic backups in a daemon thread. An interval of 0 disables it."""
+    global _scheduler
+    interval = Config.BACKUP_INTERVAL if interval is None else interval
+    if not interval or _scheduler is not None:
+        return
+    _scheduler = threading.Thread(target=_backup_loop, args=(interval,), name="backup-scheduler", daemon=True)
+    _scheduler.start()
+
+
+# ---------------- Self Check ----------------
+def check_retention():
+    """
+    Take two backups with keep=1 into a scratch directory and return its
+    listing; it must hold exactly one snapshot and nothing else.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as backup_dir:
+        backup_database(backup_dir, keep=1)
+        time.sleep(1)  # snapshot names are second-granular
+        path = backup_database(backup_dir, keep=1)
+        listing = sorted(os.listdir(backup_dir))
+    return listing, listing == [os.path.basename(path)]
+
+
+# ---------------- CLI ----------------
+# python -m utils.backup [backup | snapshot | list | restore <path> | check]
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "backup"
+    if cmd == "check":
+        listing, ok = check_retention()
+        print(f"Backup dir after two backups with keep=1: {listing}")
+        sys.exit(0 if ok else 1)
+    elif cmd == "backup":
+        print(f"Backup written to {backup_database()}")
+    elif cmd == "snapshot":
+        print(f"Reporting snapshot written to {export_snapshot()}")
+    elif cmd == "list":
+        for p in list_backups():
+            print(p)
+    elif cmd == "restore" and len(sys.argv) > 2:
+        restore_database(sys.argv[2])
+        print(f"Database restored from {sys.argv[2]}")
+    else:
+        print("usage: python -m utils.backup [backup | snapshot | list | restore <path> | check]")
+        sys.exit(1)
@@ -0,0 +1,462 @@
+import argparse
+import json
+import math
+import os
+import resource
+import secrets
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import db
+from utils.security import hash_token
+
+# ---------------- Route Benchmark ----------------
+# Times every route against one or more databases built by utils.dataset and
+# reports how latency and memory grow with data size.
+#
+#   python -m utils.dataset --size xs --out bench/xs.db
+#   python -m utils.dataset --size s --out bench/s.db
+#   python -m utils.benchmark bench/xs.db bench/s.db
+#   python -m utils.benchmark bench/xs.db --race 200   # code redemption race
+#   python -m utils.benchmark bench/xs.db --race 200 --race-control  # ...against the old code path
+#   python -m utils.benchmark bench/xs.db --startup    # cold start vs budget
+#
+# Each database is measured in its own subprocess (fresh caches, fresh writer
+# thread, honest peak RSS). Routes that write use scratch rows created per
+# iteration, but the run does add rows to the dataset: regenerate it for a
+# pristine baseline.
+
+# ---------------- Scratch Rows ----------------
+def _insert(sql, params):
+    conn = db.get_db_connection()
+    cur = conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+    return cur.lastrowid
+
+def _scratch_user(ctx):
+    name = f"bench_{secrets.token_hex(6)}"
+    return _insert("""
+        INSERT INTO users (username, email, password, name, app_password, role)
+        VALUES (?, ?, 'x', 'Bench', 'x', 'user')
+    """, (name, f"{name}@example.com"))
+
+def _scratch_app(ctx):
+    client_id = f"bench_{secrets.token_hex(8)}"
+    app_id = _insert("""
+        INSERT INTO apps (owner_id, name, client_id, client_secret, redirect_uri)
+        VALUES (?, 'Bench app', ?, 'x', 'https://bench.example.com/cb')
+    """, (ctx["developer_id"], client_id))
+    return app_id, client_id
+
+def _scratch_request(ctx):
+    return _insert("""
+        INSERT INTO app_requests (user_id, app_name, redirect_uri, description)
+        VALUES (?, 'Bench request', 'https://bench.example.com/cb', '')
+    """, (ctx["developer_id"],))
+
+def _scratch_code(ctx):
+    code = secrets.token_hex(32)
+    expires_at = (datetime.utcnow() + timedelta(minutes=10)).isoformat(timespec="seconds")
+    _insert("""
+        INSERT INTO oauth_codes (code_hash, user_id, app_id, redirect_uri, scope, scope_mask, expires_at)
+        VALUES (?, ?, ?, ?, 'profile', 1, ?)
+    """, (hash_token(code), ctx["user_id"], ctx["app_id"], ctx["redirect_uri"], expires_at))
+    return code
+
+def _scratch_profile(ctx):
+    """A small collapsed-stack file in the profiler directory; returns its name."""
+    from utils import request_profiler
+    os.makedirs(request_profiler.profile_dir(), exist_ok=True)
+    name = "bench.collapsed"
+    with open(os.path.join(request_profiler.profile_dir(), name), "w") as f:
+        f.write("app.py:index;flask:render_template 12\n")
+    return name
+
+# ---------------- Cases ----------------
+# (name, method, role, prepare) where prepare(ctx, i) returns (path, kwargs
+# for the test client). role picks the session: None, "user", "developer",
+# "owner" (owner of app 1) or "admin".
+
+def _get(path):
+    return lambda ctx, i: (path.format(**ctx), {})
+
+CASES = [
+    ("index", "GET", None, _get("/")),
+    ("about", "GET", None, _get("/about")),
+    ("terms", "GET", None, _get("/terms")),
+    ("privacy", "GET", None, _get("/privacy")),
+    ("register_form", "GET", None, _get("/register")),
+    ("register", "POST", None, lambda ctx, i: ("/register", {"data": {
+        "username": f"bench_{secrets.token_hex(6)}", "email": f"{secrets.token_hex(6)}@example.com",
+        "password": "pw", "app_password": "pw"}})),
+    ("login_form", "GET", None, _get("/login")),
+    ("login", "POST", None, lambda ctx, i: ("/login", {"data": {
+        "username_or_email": f"user{ctx['user_id']}", "password": ctx["password"]}})),
+    ("logout", "GET", "user", _get("/logout")),
+    ("dashboard_user", "GET", "user", _get("/dashboard")),
+    ("dashboard_developer", "GET", "developer", _get("/dashboard")),
+    ("edit_app_form", "GET", "owner", _get("/app/{app_id}/edit")),
+    ("edit_app", "POST", "owner", lambda ctx, i: (f"/app/{ctx['app_id']}/edit", {"data": {
+        "app_name": "App 1", "redirect_uri": ctx["redirect_uri"], "description": "Synthetic app 1"}})),
+    ("profile", "GET", None, _get("/profile/user{user_id}")),
+    ("tutorial", "GET", "owner", _get("/tutorial/{app_id}")),
+    ("request_app_form", "GET", "developer", _get("/app/new")),
+    ("request_app", "POST", "developer", lambda ctx, i: ("/app/new", {"data": {
+        "app_name": "Bench", "redirect_uri": "https://bench.example.com/cb", "description": ""}})),
+    ("admin", "GET", "admin", _get("/admin")),
+    ("manage_app_requests", "GET", "admin", _get("/admin/manage/app-requests")),
+    ("manage_apps", "GET", "admin", _get("/admin/manage/apps")),
+    ("revoke_access_form", "GET", "admin", _get("/admin/manage/revoke-access")),
+    ("revoke_access", "POST", "admin", lambda ctx, i: ("/admin/manage/revoke-access", {"data": {
+        "action": "user", "user_id": _scratch_user(ctx)}})),
+    ("manage_users_form", "GET", "admin", _get("/admin/manage/users")),
+    ("manage_users", "POST", "admin", lambda ctx, i: ("/admin/manage/users", {"data": {
+        "user_id": _scratch_user(ctx), "role": "developer"}})),
+    ("approve_app_request", "GET", "admin",
+     lambda ctx, i: (f"/admin/manage/app-requests/{_scratch_request(ctx)}/approve", {})),
+    ("deny_app_request", "GET", "admin",
+     lambda ctx, i: (f"/admin/manage/app-requests/{_scratch_request(ctx)}/deny", {})),
+    ("set_admin", "GET", None, lambda ctx, i: (f"/set-admin/{_scratch_user(ctx)}", {})),
+    ("revoke_user", "GET", "admin", lambda ctx, i: (f"/admin/revoke/user/{_scratch_user(ctx)}", {})),
+    ("revoke_app", "GET", "admin", lambda ctx, i: (f"/admin/revoke/app/{_scratch_app(ctx)[0]}", {})),
+    ("sql_profiler", "GET", "admin", _get("/admin/sql-profiler")),
+    ("writer_metrics", "GET", "admin", _get("/admin/metrics/writer")),
+    ("request_profiler", "GET", "admin", _get("/admin/profiler")),
+    ("request_profiler_file", "GET", "admin",
+     lambda ctx, i: (f"/admin/profiler/files/{_scratch_profile(ctx)}", {})),
+    ("api_userinfo", "POST", None, lambda ctx, i: ("/api/userinfo", {"json": {
+        "access_token": ctx["live_tokens"][i % len(ctx["live_tokens"])]["access_token"]}})),
+    ("api_app_usage", "GET", "owner", _get("/api/apps/{app_id}/usage")),
+    ("oauth_authorize_form", "GET", "user", _get(
+        "/oauth/authorize?client_id={client_id}&redirect_uri={redirect_uri}&scope=profile&prompt=consent")),
+    ("oauth_authorize", "POST", "user", lambda ctx, i: ("/oauth/authorize", {"data": {
+        "client_id": ctx["client_id"], "redirect_uri": ctx["redirect_uri"], "scope": "profile",
+        "action": "approve"}})),
+    ("oauth_token", "POST", None, lambda ctx, i: ("/oauth/token", {"data": {
+        "client_id": ctx["client_id"], "client_secret": ctx["client_secret"], "code": _scratch_code(ctx),
+        "redirect_uri": ctx["redirect_uri"]}})),
+    ("oauth_revoke", "POST", "admin", lambda ctx, i: ("/oauth/revoke", {"data": {
+        "client_id": _scratch_app(ctx)[1]}})),
+    ("oauth_logs", "GET", "admin", _get("/oauth/logs")),
+    ("suggestions", "GET", None, _get("/suggestions")),
+    ("suggestions_search", "GET", None, _get("/suggestions?q=support")),
+    ("suggestion_post", "POST", "user", lambda ctx, i: ("/suggestions", {"data": {
+        "title": f"Bench {i}", "content": "Synthetic suggestion"}})),
+    ("api_suggestions", "GET", None, _get("/api/suggestions")),
+    ("api_suggestions_search", "GET", None, _get("/api/suggestions?q=support")),
+    ("api_suggestion_create", "POST", "user", lambda ctx, i: ("/api/suggestions", {"json": {
+        "title": f"Bench {i}", "content": "Synthetic suggestion"}})),
+]
+
+# ---------------- Worker ----------------
+def _measure(path, iterations, selected):
+    """Run the cases against one database; called in a dedicated subprocess."""
+    with open(path + ".json") as f:
+        ctx = json.load(f)
+    db.DB_FILE = path
+    from app import app  # imported late: the first request runs init_db() against DB_FILE
+
+    roles = {
+        None: None, "user": ctx["user_id"], "developer": ctx["developer_id"],
+        "owner": ctx["app_owner_id"], "admin": ctx["admin_id"],
+    }
+    client = app.test_client()
+
+    def call(method, role, prepare, i):
+        url, kwargs = prepare(ctx, i)
+        with client.session_transaction() as s:
+            s.clear()
+            if roles[role] is not None:
+                s["user_id"] = roles[role]
+        start = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        response.close()
+        return response.status_code, elapsed
+
+    results = {}
+    for name, method, role, prepare in CASES:
+        if selected and name not in selected:
+            continue
+        try:
+            status, _ = call(method, role, prepare, 0)  # warm-up
+            times = [call(method, role, prepare, i)[1] for i in range(1, iterations + 1)]
+            tracemalloc.start()
+            call(method, role, prepare, iterations + 1)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        except Exception as e:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        times.sort()
+        results[name] = {
+            "status": status,
+            "p50_ms": statistics.median(times),
+            "p95_ms": times[min(int(len(times) * 0.95), len(times) - 1)],
+            "max_ms": times[-1],
+            "peak_kb": peak / 1024,
+        }
+    return {
+        "path": path,
+        "rows": ctx["users"] + ctx["apps"] + ctx["tokens"] + ctx["logs"],
+        "sizes": {k: ctx[k] for k in ("users", "apps", "tokens", "logs")},
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "routes": results,
+    }
+
+# ---------------- Code Redemption Race ----------------
+# Every contender is a separate process with its own writer thread and its
+# own SQLite connection, like gunicorn workers: only the database itself can
+# stop a code being redeemed twice. --race-control runs the old
+# check-then-update redemption (SELECT used=0, then UPDATE) on the same
+# setup to show the harness does catch a double redemption.
+
+def _naive_exchange(form):
+    """Pre-fix redemption: read the code, then mark it used, as two steps on a plain connection."""
+    conn = db.get_db_connection()
+    try:
+        row = conn.execute("SELECT id FROM oauth_codes WHERE code_hash=? AND used=0",
+                           (hash_token(form["code"]),)).fetchone()
+        if not row:
+            return 400
+        time.sleep(0.001)  # the request work between the two steps
+        conn.execute("UPDATE oauth_codes SET used=1 WHERE id=?", (row["id"],))
+        conn.commit()
+        return 200
+    finally:
+        conn.close()
+
+def _race_worker(path, forms, barrier, results, control):
+    db.DB_FILE = path
+    from app import app
+    client = app.test_client()
+    statuses = []
+    for form in forms:
+        barrier.wait()
+        if control:
+            statuses.append(_naive_exchange(form))
+        else:
+            statuses.append(client.post("/oauth/token", data=form).status_code)
+    results.put(statuses)
+
+def race_redemption(path, codes, processes, control=False):
+    """
+    Have `processes` worker processes exchange each of `codes` fresh auth
+    codes at the same moment. Returns (codes, redeemed, double_redeemed,
+    tokens_issued); a correct endpoint redeems every code exactly once and
+    issues exactly `codes` tokens.
+    """
+    import multiprocessing
+    with open(path + ".json") as f:
+        ctx = json.load(f)
+    db.DB_FILE = path
+
+    def count_tokens():
+        conn = db.get_db_connection()
+        n = conn.execute("SELECT COUNT(*) FROM oauth_tokens").fetchone()[0]
+        conn.close()
+        return n
+
+    before = count_tokens()
+    forms = [{"client_id": ctx["client_id"], "client_secret": ctx["client_secret"],
+              "code": _scratch_code(ctx), "redirect_uri": ctx["redirect_uri"]} for _ in range(codes)]
+    # spawn, not fork: each contender starts its own writer thread and connection
+    mp = multiprocessing.get_context("spawn")
+    barrier = mp.Barrier(processes)
+    results = mp.Queue()
+    workers = [mp.Process(target=_race_worker, args=(path, forms, barrier, results, control))
+               for _ in range(processes)]
+    [w.start() for w in workers]
+    per_worker = [results.get() for _ in workers]
+    [w.join() for w in workers]
+
+    redeemed = double = 0
+    for statuses in zip(*per_worker):
+        wins = statuses.count(200)
+        redeemed += wins == 1
+        double += wins > 1
+    issued = count_tokens() - before
+    return codes, redeemed, double, issued
+
+# ---------------- Startup Budget ----------------
+# Each probe is a fresh interpreter that times `import app`, then the first
+# and second request to a few template-rendering pages, then reads its RSS.
+# The first request also pays for app.start_services() (migrations, background
+# threads), as it does in a fresh worker. The probe runs from plain
+# `python -c` so none of this module's imports are preloaded and counted as
+# free.
+STARTUP_PATHS = ("/", "/login", "/register", "/suggestions")
+
+_STARTUP_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import db
+db.DB_FILE = sys.argv[1]
+from app import app
+import_ms = (time.perf_counter() - start) * 1000
+client = app.test_client()
+first, second = {}, {}
+for timings in (first, second):
+    for path in sys.argv[2:]:
+        t = time.perf_counter()
+        client.get(path).close()
+        timings[path] = (time.perf_counter() - t) * 1000
+rss_kb = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss_kb = int(line.split()[1])
+if not rss_kb:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"import_ms": import_ms, "first": first, "second": second, "rss_mb": rss_kb / 1024}))
+'''
+
+def startup_check(path, runs, budgets):
+    """
+    Median import time, first-request latency (worst page) and RSS over
+    `runs` fresh processes. Returns (results, [budget names exceeded]).
+    """
+    samples = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, path, *STARTUP_PATHS],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "probe failed")
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    results = {
+        "import_ms": statistics.median(s["import_ms"] for s in samples),
+        "first_request_ms": statistics.median(max(s["first"].values()) for s in samples),
+        "warm_request_ms": statistics.median(max(s["second"].values()) for s in samples),
+        "rss_mb": statistics.median(s["rss_mb"] for s in samples),
+        "pages": {p: statistics.median(s["first"][p] for s in samples) for p in STARTUP_PATHS},
+    }
+    over = [name for name, limit in budgets.items() if limit and results[name] > limit]
+    return results, over
+
+# ---------------- Report ----------------
+def _growth(first, last, size_ratio):
+    """Exponent k in time ~ size^k between the smallest and largest dataset."""
+    if size_ratio <= 1 or first <= 0 or last <= 0:
+        return None
+    return math.log(last / first) / math.log(size_ratio)
+
+def report(runs):
+    runs = sorted(runs, key=lambda r: r["rows"])
+    labels = [os.path.basename(r["path"]) for r in runs]
+    print()
+    for r, label in zip(runs, labels):
+        s = r["sizes"]
+        print(f"{label}: {s['users']:,} users, {s['apps']:,} apps, {s['tokens']:,} tokens, "
+              f"{s['logs']:,} log rows; peak RSS {r['max_rss_mb']:.0f} MB")
+    print()
+    header = f"{'route':<24}" + "".join(f"{l + ' p50/p95 ms':>24}" for l in labels)
+    header += f"{'peak KB':>12}{'growth':>8}"
+    print(header)
+    print("-" * len(header))
+
+    size_ratio = runs[-1]["rows"] / runs[0]["rows"] if runs[0]["rows"] else 0
+    for name, *_ in CASES:
+        cells = [r["routes"].get(name) for r in runs]
+        if all(c is None for c in cells):
+            continue
+        line = f"{name:<24}"
+        for c in cells:
+            if c is None:
+                line += f"{'-':>24}"
+            elif "error" in c:
+                line += f"{'error':>24}"
+            else:
+                line += f"{c['p50_ms']:>14.2f} / {c['p95_ms']:<7.2f}"
+        last = cells[-1]
+        line += f"{last['peak_kb']:>12.0f}" if last and "error" not in last else f"{'-':>12}"
+        ok = [c for c in cells if c and "error" not in c]
+        growth = _growth(ok[0]["p50_ms"], ok[-1]["p50_ms"], size_ratio) if len(ok) == len(runs) > 1 else None
+        line += f"{growth:>8.2f}" if growth is not None else f"{'':>8}"
+        print(line)
+
+    print("\ngrowth: k in p50 ~ rows^k between the smallest and largest dataset "
+          "(~0 constant or indexed, ~1 linear in table size).")
+    for r, label in zip(runs, labels):
+        for name, c in r["routes"].items():
+            if "error" in c:
+                print(f"{label} {name}: {c['error']}")
+
+
+# ---------------- CLI ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every route against synthetic datasets.")
+    parser.add_argument("databases", nargs="+", help="databases created by utils.dataset")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--routes", help="comma separated route names to run (default all)")
+    parser.add_argument("--skip", help="comma separated route names to leave out")
+    parser.add_argument("--json", help="also write raw results to this file")
+    parser.add_argument("--race", type=int, metavar="CODES",
+                        help="instead of timing routes, race concurrent exchanges of CODES auth codes")
+    parser.add_argument("--processes", type=int, default=8, help="concurrent worker processes for --race")
+    parser.add_argument("--race-control", action="store_true",
+                        help="race the old check-then-update redemption instead; expected to fail")
+    parser.add_argument("--startup", action="store_true",
+                        help="instead of timing routes, check cold start against the budgets below")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes measured for --startup")
+    parser.add_argument("--max-import-ms", type=float, default=600)
+    parser.add_argument("--max-first-request-ms", type=float, default=25)
+    parser.add_argument("--max-rss-mb", type=float, default=120)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    selected = set(args.routes.split(",")) if args.routes else {name for name, *_ in CASES}
+    if args.skip:
+        selected -= set(args.skip.split(","))
+
+    if args.race:
+        codes, redeemed, double, issued = race_redemption(args.databases[0], args.race, args.processes,
+                                                          control=args.race_control)
+        print(f"{codes} codes x {args.processes} concurrent processes: {redeemed} redeemed once, "
+              f"{double} redeemed more than once, {issued} tokens issued")
+        sys.exit(0 if redeemed == codes and issued == codes else 1)
+
+    if args.startup:
+        budgets = {"import_ms": args.max_import_ms, "first_request_ms": args.max_first_request_ms,
+                   "rss_mb": args.max_rss_mb}
+        results, over = startup_check(args.databases[0], args.runs, budgets)
+        print(f"Cold start, median of {args.runs} fresh processes:")
+        print(f"  import app          {results['import_ms']:8.1f} ms   (budget {budgets['import_ms']:g})")
+        print(f"  first request, max  {results['first_request_ms']:8.1f} ms   (budget {budgets['first_request_ms']:g})")
+        print(f"  warm request, max   {results['warm_request_ms']:8.1f} ms")
+        print(f"  worker RSS          {results['rss_mb']:8.1f} MB   (budget {budgets['rss_mb']:g})")
+        for page, ms in results["pages"].items():
+            print(f"    first GET {page:<14}{ms:8.1f} ms")
+        if over:
+            print(f"Over budget: {', '.join(over)}")
+        sys.exit(1 if over else 0)
+
+    if args.worker:
+        # The app prints on startup, so the result is always the last stdout line
+        print(json.dumps(_measure(args.databases[0], args.iterations, selected)))
+        sys.exit(0)
+
+    runs = []
+    for path in args.databases:
+        print(f"Benchmarking {path} ...", flush=True)
+        proc = subprocess.run(
+            [sys.executable, "-m", "utils.benchmark", path, "--worker",
+             "--iterations", str(args.iterations), "--routes", ",".join(sorted(selected))],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            print(proc.stderr)
+            sys.exit(proc.returncode)
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    report(runs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(runs, f, indent=2)
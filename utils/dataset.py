@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+import db
+from utils.security import hash_password, hash_token
+from utils.scopes import ALL_SCOPES, scope_names
+
+# ---------------- Synthetic Dataset ----------------
+# Builds a database with the real schema (db.init_db) at a chosen scale, for
+# benchmarking. Output is deterministic for a given seed and size: every
+# random choice comes from one seeded RNG and every secret is derived from
+# (seed, kind, index), so two runs produce the same rows.
+#
+# Rows are streamed into executemany() from generators inside a single
+# transaction with journaling and fsync turned off; the file is switched back
+# to WAL and ANALYZEd at the end.
+#
+# A sidecar <db>.json records the parameters plus known-good credentials
+# (admin, developer, user, live access tokens) for utils.benchmark.
+
+SIZES = {
+    #        users      apps     tokens      log rows
+    "xs": (1_000, 100, 10_000, 100_000),
+    "s": (10_000, 1_000, 100_000, 1_000_000),
+    "m": (100_000, 10_000, 1_000_000, 10_000_000),
+    "l": (1_000_000, 100_000, 10_000_000, 100_000_000),
+}
+
+PASSWORD = "password"
+BASE_TIME = datetime(2025, 1, 1)
+SPAN_SECONDS = 90 * 24 * 3600
+LOG_ACTIONS = ("token_issued", "login", "approve", "deny", "revoke")
+WORDS = ("fast", "dark", "mode", "login", "export", "search", "profile", "api",
+         "token", "email", "mobile", "report", "theme", "billing", "sync", "team")
+
+def _secret(seed, kind, i, length=64):
+    return hashlib.sha256(f"{seed}:{kind}:{i}".encode()).hexdigest()[:length]
+
+def _ts(seconds):
+    return (BASE_TIME + timedelta(seconds=seconds)).isoformat(sep=" ")
+
+def _picker(rng, n, dist, skew):
+    """
+    Return a function drawing an index in [0, n).
+    uniform: every index equally likely; zipf: a few indexes get most draws
+    (index 0 is the heaviest), controlled by skew > 1.
+    """
+    if dist == "uniform":
+        return lambda: rng.randrange(n)
+    if dist == "zipf":
+        return lambda: min(int(n * rng.random() ** skew), n - 1)
+    raise ValueError(f"unknown distribution {dist}")
+
+def _progress(rows, label, total):
+    step = max(total // 20, 1)
+    start = time.perf_counter()
+    for i, row in enumerate(rows, 1):
+        if i % step == 0:
+            print(f"  {label}: {i:,}/{total:,} ({time.perf_counter() - start:.0f}s)", flush=True)
+        yield row
+
+def generate(path, users, apps, tokens, logs, suggestions=None, developers=None,
+             token_dist="zipf", app_dist="zipf", skew=3.0, expired_ratio=0.3, seed=1):
+    """
+    Create a fresh database at `path`. Returns the metadata written to <path>.json.
+    `token_dist` decides how tokens spread over users, `app_dist` how apps
+    spread over developers.
+    """
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    suggestions = users // 10 if suggestions is None else suggestions
+    developers = max(users // 100, 1) if developers is None else developers
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    db.DB_FILE = path
+    db.init_db()
+    conn = db.get_db_connection()
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB
+    conn.execute("PRAGMA temp_store=MEMORY")
+    cur = conn.cursor()
+
+    # ---------------- Users ----------------
+    # id 1 is the admin, ids 2..developers+1 are developers, the rest users.
+    # Everyone shares one password hash, so login can be benchmarked.
+    pwd_hash = hash_password(PASSWORD, salt=_secret(seed, "salt", 0, 32))
+
+    def user_rows():
+        for i in range(1, users + 1):
+            role = "admin" if i == 1 else "developer" if i <= developers + 1 else "user"
+            yield (i, f"user{i}", f"user{i}@example.com", pwd_hash, f"User {i}",
+                   _secret(seed, "app_password", i, 16), f"+1555{i:07d}", role,
+                   _ts(rng.randrange(SPAN_SECONDS)))
+    cur.executemany("""
+        INSERT INTO users (id, username, email, password, name, app_password, phone, role, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, _progress(user_rows(), "users", users))
+
+    # ---------------- Apps ----------------
+    pick_developer = _picker(rng, developers, app_dist, skew)
+
+    def app_rows():
+        for i in range(1, apps + 1):
+            yield (i, 2 + pick_developer(), f"App {i}", _secret(seed, "client_id", i, 40),
+                   _secret(seed, "client_secret", i), f"https://app{i}.example.com/callback",
+                   f"Synthetic app {i}", _ts(rng.randrange(SPAN_SECONDS)))
+    cur.executemany("""
+        INSERT INTO apps (id, owner_id, name, client_id, client_secret, redirect_uri, description, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, _progress(app_rows(), "apps", apps))
+    cur.execute("""
+        INSERT INTO app_redirect_uris (app_id, uri, is_pattern)
+        SELECT id, redirect_uri, 0 FROM apps
+    """)
+
+    # ---------------- Grants and Tokens ----------------
+    pick_user = _picker(rng, users, token_dist, skew)
+    scope = " ".join(sorted(scope_names(ALL_SCOPES)))
+    live_tokens = []
+
+    def token_rows():
+        for i in range(1, tokens + 1):
+            user_id, app_id = 1 + pick_user(), 1 + rng.randrange(apps)
+            created = rng.randrange(SPAN_SECONDS)
+            expired = rng.random() < expired_ratio
+            expires_at = ((BASE_TIME + timedelta(seconds=created + 3600)).isoformat(timespec="seconds")
+                          if expired else "2099-01-01T00:00:00")
+            access_token = _secret(seed, "access", i)
+            if not expired and len(live_tokens) < 50:
+                live_tokens.append({"access_token": access_token, "user_id": user_id, "app_id": app_id})
+            yield (user_id, app_id, hash_token(access_token), hash_token(_secret(seed, "refresh", i)),
+                   expires_at, _ts(created), ALL_SCOPES)
+    cur.executemany("""
+        INSERT INTO oauth_tokens (user_id, app_id, access_token_hash, refresh_token_hash, expires_at, created_at, scope_mask)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, _progress(token_rows(), "tokens", tokens))
+    # Every token implies a grant for its (user, app)
+    cur.execute("""
+        INSERT OR IGNORE INTO oauth_authorizations (user_id, app_id, scope, scope_mask, authorized_at)
+        SELECT user_id, app_id, ?, ?, MIN(created_at) FROM oauth_tokens GROUP BY user_id, app_id
+    """, (scope, ALL_SCOPES))
+
+    # ---------------- Logs ----------------
+    def log_rows():
+        step = SPAN_SECONDS / max(logs, 1)
+        for i in range(logs):
+            yield (1 + pick_user(), 1 + rng.randrange(apps), LOG_ACTIONS[rng.randrange(len(LOG_ACTIONS))],
+                   _ts(int(i * step)))
+    cur.executemany(
+        "INSERT INTO oauth_logs (user_id, app_id, action, timestamp) VALUES (?, ?, ?, ?)",
+        _progress(log_rows(), "logs", logs)
+    )
+
+    # ---------------- Suggestions ----------------
+    def suggestion_rows():
+        for i in range(suggestions):
+            words = rng.sample(WORDS, 4)
+            yield (1 + pick_user(), " ".join(words[:2]).capitalize(),
+                   f"Please add {' and '.join(words)} support.", _ts(rng.randrange(SPAN_SECONDS)))
+    cur.executemany(
+        "INSERT INTO suggestions (user_id, title, content, created_at) VALUES (?, ?, ?, ?)",
+        _progress(suggestion_rows(), "suggestions", suggestions)
+    )
+
+    app_owner_id = cur.execute("SELECT owner_id FROM apps WHERE id=1").fetchone()[0] if apps else None
+    conn.commit()
+    print("  analyzing...", flush=True)
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+    meta = {
+        "seed": seed,
+        "users": users, "apps": apps, "tokens": tokens, "logs": logs,
+        "suggestions": suggestions, "developers": developers,
+        "token_dist": token_dist, "app_dist": app_dist, "skew": skew, "expired_ratio": expired_ratio,
+        "password": PASSWORD,
+        "admin_id": 1,
+        "developer_id": 2,          # heaviest developer under zipf
+        "user_id": users,           # a light, ordinary user
+        "app_id": 1,
+        "app_owner_id": app_owner_id,
+        "client_id": _secret(seed, "client_id", 1, 40),
+        "client_secret": _secret(seed, "client_secret", 1),
+        "redirect_uri": "https://app1.example.com/callback",
+        "live_tokens": live_tokens,
+        "build_seconds": round(time.perf_counter() - started, 1),
+    }
+    with open(path + ".json", "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+# ---------------- CLI ----------------
+# python -m utils.dataset --size s --out bench/s.db
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Stybase database.")
+    parser.add_argument("--size", choices=SIZES, default="xs", help="preset row counts")
+    parser.add_argument("--out", help="database path (default bench/<size>.db)")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--apps", type=int)
+    parser.add_argument("--tokens", type=int)
+    parser.add_argument("--logs", type=int)
+    parser.add_argument("--suggestions", type=int)
+    parser.add_argument("--developers", type=int)
+    parser.add_argument("--token-dist", choices=("uniform", "zipf"), default="zipf")
+    parser.add_argument("--app-dist", choices=("uniform", "zipf"), default="zipf")
+    parser.add_argument("--skew", type=float, default=3.0)
+    parser.add_argument("--expired-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    users, apps, tokens, logs = SIZES[args.size]
+    out = args.out or os.path.join("bench", f"{args.size}.db")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    meta = generate(
+        out,
+        users=args.users or users, apps=args.apps or apps,
+        tokens=args.tokens if args.tokens is not None else tokens,
+        logs=args.logs if args.logs is not None else logs,
+        suggestions=args.suggestions, developers=args.developers,
+        token_dist=args.token_dist, app_dist=args.app_dist, skew=args.skew,
+        expired_ratio=args.expired_ratio, seed=args.seed,
+    )
+    print(f"Wrote {out} in {meta['build_seconds']}s")
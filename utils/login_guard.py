@@ -0,0 +1,152 @@
+import hashlib
+import math
+import string
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from db import get_db_connection
+
+# ---------------- Login Guard ----------------
+# Keeps credential-stuffing traffic off the database and the password hasher.
+#
+# Existence filter: a Bloom filter over every login identifier (lowercased
+# username and email), built from the users table in a background thread on
+# first use and extended by register_user. An identifier the filter has never seen is rejected
+# without touching SQLite. Accounts registered by another worker are picked
+# up by a catch-up read of new user ids, at most once per
+# LOGIN_FILTER_REFRESH seconds. The filter never forgets, so deleted or
+# renamed identifiers only cost a normal lookup.
+#
+# Lockout: per-identifier failure counters. After LOGIN_MAX_FAILURES failures
+# within LOGIN_FAILURE_WINDOW seconds the identifier is locked for
+# LOGIN_LOCKOUT_SECONDS and rejected before any lookup. Counters live in a
+# bounded LRU per worker process.
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def normalize(identifier: str) -> str:
+    """Canonical login identifier; matches SQLite's lower(), which only folds ASCII."""
+    return (identifier or "").strip().translate(_ASCII_LOWER)
+
+# ---------------- Existence Filter ----------------
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for p in self._positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+_filter = None
+_max_user_id = 0
+_refreshed_at = 0.0
+_filter_lock = threading.Lock()
+_builder = None
+
+def _load(cur, bloom, after_id):
+    cur.execute("SELECT id, username, email FROM users WHERE id > ? ORDER BY id", (after_id,))
+    last = after_id
+    for user_id, username, email in cur:
+        bloom.add(normalize(username))
+        bloom.add(normalize(email))
+        last = user_id
+    return last
+
+def _build():
+    """Build a filter sized for the current users table, off the request path."""
+    global _filter, _max_user_id, _refreshed_at, _builder
+    try:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM users")
+            bloom = BloomFilter(max(Config.LOGIN_FILTER_CAPACITY, 4 * cur.fetchone()[0]))
+            max_user_id = _load(cur, bloom, 0)
+            with _filter_lock:
+                # Catch up on anything registered while the build ran
+                max_user_id = _load(cur, bloom, max_user_id)
+                _filter, _max_user_id, _refreshed_at = bloom, max_user_id, time.monotonic()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Login filter build failed: {e}")
+    finally:
+        _builder = None
+
+def _catch_up():
+    """Add users created since the last read (e.g. by other workers). Caller holds _filter_lock."""
+    global _max_user_id, _refreshed_at
+    conn = get_db_connection()
+    try:
+        _max_user_id = _load(conn.cursor(), _filter, _max_user_id)
+    finally:
+        conn.close()
+    _refreshed_at = time.monotonic()
+
+def might_exist(identifier: str) -> bool:
+    """
+    False only if no account uses this (normalized) identifier. Answers True
+    while the filter is still being built, so logins fall through to the database.
+    """
+    global _builder
+    if _filter is None or _filter.count > _filter.capacity:
+        with _filter_lock:
+            if _builder is None:
+                _builder = threading.Thread(target=_build, name="login-filter", daemon=True)
+                _builder.start()
+        if _filter is None:
+            return True
+    if identifier in _filter:
+        return True
+    with _filter_lock:
+        if time.monotonic() - _refreshed_at >= Config.LOGIN_FILTER_REFRESH:
+            _catch_up()
+        return identifier in _filter
+
+def add(*identifiers):
+    """Record identifiers of a newly registered account."""
+    with _filter_lock:
+        if _filter is not None:
+            for identifier in identifiers:
+                _filter.add(normalize(identifier))
+
+# ---------------- Failure Counters ----------------
+_failures = OrderedDict()  # identifier -> [failures, window_start, locked_until]
+_failures_lock = threading.Lock()
+
+def is_locked(identifier: str) -> bool:
+    with _failures_lock:
+        entry = _failures.get(identifier)
+        return entry is not None and entry[2] > time.monotonic()
+
+def record_failure(identifier: str):
+    now = time.monotonic()
+    with _failures_lock:
+        entry = _failures.get(identifier)
+        if entry is None or now - entry[1] > Config.LOGIN_FAILURE_WINDOW or 0 < entry[2] <= now:
+            entry = _failures[identifier] = [0, now, 0.0]
+        _failures.move_to_end(identifier)
+        entry[0] += 1
+        if entry[0] >= Config.LOGIN_MAX_FAILURES:
+            entry[2] = now + Config.LOGIN_LOCKOUT_SECONDS
+        while len(_failures) > Config.LOGIN_TRACKED_IDENTIFIERS:
+            _failures.popitem(last=False)
+
+def record_success(identifier: str):
+    with _failures_lock:
+        _failures.pop(identifier, None)
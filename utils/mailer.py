@@ -0,0 +1,181 @@
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from config import Config
+from db import get_db_connection
+
+# ---------------- Email Outbox ----------------
+# Request handlers only insert into email_outbox, inside their own
+# transaction. A background sender claims due rows in batches and delivers
+# them over a single reused SMTP connection, retrying with backoff.
+
+EMAIL_TEMPLATES = {
+    "registration": (
+        "Welcome to Stybase, {username}",
+        "Hi {username},\n\nYour Stybase account has been created.\n\n{base_url}/login\n",
+    ),
+    "app_request_approved": (
+        "Your app '{app_name}' was approved",
+        "Hi {username},\n\nYour app request '{app_name}' has been approved. "
+        "You can find its credentials on your dashboard:\n\n{base_url}/dashboard\n",
+    ),
+    "app_request_denied": (
+        "Your app '{app_name}' was not approved",
+        "Hi {username},\n\nYour app request '{app_name}' has been denied by an administrator.\n",
+    ),
+    "user_revoked": (
+        "Your Stybase access has been revoked",
+        "Hi {username},\n\nAn administrator has revoked your Stybase account. "
+        "Apps you signed in to can no longer access your data.\n",
+    ),
+    "app_revoked": (
+        "Your app '{app_name}' has been revoked",
+        "Hi {username},\n\nYour app '{app_name}' has been revoked by an administrator. "
+        "Its tokens are no longer valid.\n",
+    ),
+}
+
+_wakeup = threading.Event()
+_sender = None
+
+def queue_email(cur, to_addr, template: str, **context):
+    """
+    Render a template and add it to the outbox using the caller's cursor, so the
+    message commits (or rolls back) with the change that triggered it.
+    """
+    if not Config.EMAIL_ENABLED or not to_addr:
+        return
+    subject, body = EMAIL_TEMPLATES[template]
+    context.setdefault("base_url", Config.BASE_URL)
+    cur.execute("""
+        INSERT INTO email_outbox (to_addr, template, subject, body)
+        VALUES (?, ?, ?, ?)
+    """, (to_addr, template, subject.format(**context), body.format(**context)))
+    _wakeup.set()
+
+# ---------------- Sender ----------------
+def _claim_batch(limit):
+    """Atomically move up to `limit` due messages to 'sending'. Returns the claimed rows."""
+    now = datetime.utcnow().isoformat(sep=" ", timespec="seconds")
+    stale = (datetime.utcnow() - timedelta(minutes=10)).isoformat(sep=" ", timespec="seconds")
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Messages left in 'sending' by a crashed worker go back in the queue
+    cur.execute("UPDATE email_outbox SET status='pending' WHERE status='sending' AND claimed_at < ?", (stale,))
+    cur.execute("""
+        UPDATE email_outbox SET status='sending', claimed_at=?
+        WHERE id IN (
+            SELECT id FROM email_outbox
+            WHERE status='pending' AND next_attempt_at <= ?
+            ORDER BY id LIMIT ?
+        )
+        RETURNING id, to_addr, subject, body, attempts
+    """, (now, now, limit))
+    rows = cur.fetchall()
+    conn.commit()
+    conn.close()
+    return rows
+
+def _finish(results):
+    """Record delivery results: list of (id, attempts, error or None)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    for msg_id, attempts, error in results:
+        if error is None:
+            cur.execute("UPDATE email_outbox SET status='sent', sent_at=CURRENT_TIMESTAMP WHERE id=?", (msg_id,))
+            continue
+        attempts += 1
+        if attempts >= Config.EMAIL_MAX_ATTEMPTS:
+            cur.execute("""
+                UPDATE email_outbox SET status='failed', attempts=?, last_error=? WHERE id=?
+            """, (attempts, error, msg_id))
+        else:
+            delay = min(Config.EMAIL_RETRY_BASE * 2 ** (attempts - 1), 3600)
+            retry_at = (datetime.utcnow() + timedelta(seconds=delay)).isoformat(sep=" ", timespec="seconds")
+            cur.execute("""
+                UPDATE email_outbox SET status='pending', attempts=?, last_error=?, next_attempt_at=?
+                WHERE id=?
+            """, (attempts, error, retry_at, msg_id))
+    conn.commit()
+    conn.close()
+
+def _connect():
+    smtp = smtplib.SMTP(Config.EMAIL_HOST, Config.EMAIL_PORT, timeout=30)
+    if Config.EMAIL_USE_TLS:
+        smtp.starttls()
+    if Config.EMAIL_USERNAME:
+        smtp.login(Config.EMAIL_USERNAME, Config.EMAIL_PASSWORD)
+    return smtp
+
+class Sender:
+    """Delivers outbox batches, keeping one SMTP session open while there is work."""
+
+    def __init__(self, connect=_connect):
+        self._connect = connect
+        self._smtp = None
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _send(self, row):
+        msg = EmailMessage()
+        msg["From"] = Config.EMAIL_FROM
+        msg["To"] = row["to_addr"]
+        msg["Subject"] = row["subject"]
+        msg.set_content(row["body"])
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Reused session went away; reconnect once and retry this message
+            self._smtp = self._connect()
+            self._smtp.send_message(msg)
+
+    def send_pending(self):
+        """Send one batch of due messages. Returns the number claimed."""
+        rows = _claim_batch(Config.EMAIL_BATCH_SIZE)
+        results = []
+        try:
+            for row in rows:
+                try:
+                    self._send(row)
+                    results.append((row["id"], row["attempts"], None))
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException, ValueError) as e:
+                    # Rejected by the server or unbuildable; the session itself is still usable
+                    results.append((row["id"], row["attempts"], str(e)[:500]))
+                except (smtplib.SMTPException, OSError) as e:
+                    self.close()
+                    results.append((row["id"], row["attempts"], str(e)[:500]))
+        finally:
+            # Record what was sent even if something unexpected escapes, so
+            # those messages aren't reclaimed as stale and sent twice
+            if results:
+                _finish(results)
+        return len(rows)
+
+def _send_loop():
+    sender = Sender()
+    while True:
+        _wakeup.wait(Config.EMAIL_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            while sender.send_pending():
+                pass
+        except Exception as e:
+            print(f"Email sender failed: {e}")
+        sender.close()
+
+def start_sender():
+    """Start the background sender for this process (no-op when email is disabled)."""
+    global _sender
+    if not Config.EMAIL_ENABLED or _sender is not None:
+        return
+    _sender = threading.Thread(target=_send_loop, name="email-sender", daemon=True)
+    _sender.start()
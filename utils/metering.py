@@ -0,0 +1,121 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from config import Config
+from db import get_db_connection
+
+# ---------------- Usage Metering ----------------
+# Hits are counted in process memory and periodically folded into the
+# app_usage_hourly rollup table, so the request path never writes to the DB.
+
+EVENTS = ("authorize", "token", "userinfo", "error")
+
+_counters = {}  # (app_id, event, epoch_hour) -> count
+_lock = threading.Lock()
+_flusher = None
+
+def record_hit(app_id, event: str):
+    """Count one event for an app. In-memory only."""
+    if app_id is None:
+        return
+    key = (app_id, event, int(time.time()) // 3600)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+    if _flusher is None:
+        _start_flusher()
+
+def _hour_label(epoch_hour: int) -> str:
+    return datetime.utcfromtimestamp(epoch_hour * 3600).strftime("%Y-%m-%d %H:00:00")
+
+def flush():
+    """Swap out the in-memory counters and upsert them into the rollup table."""
+    global _counters
+    with _lock:
+        pending, _counters = _counters, {}
+    if not pending:
+        return 0
+
+    rows = [(app_id, _hour_label(hour), event, count) for (app_id, event, hour), count in pending.items()]
+    conn = get_db_connection()
+    try:
+        conn.executemany("""
+            INSERT INTO app_usage_hourly (app_id, hour, event, count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(app_id, hour, event) DO UPDATE SET count = count + excluded.count
+        """, rows)
+        conn.commit()
+    except Exception:
+        # Put the counts back so the next flush retries them
+        with _lock:
+            for key, count in pending.items():
+                _counters[key] = _counters.get(key, 0) + count
+        raise
+    finally:
+        conn.close()
+    return len(rows)
+
+def _flush_loop():
+    while True:
+        time.sleep(Config.METERING_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Metering flush failed: {e}")
+
+def _start_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_flush_loop, name="metering-flusher", daemon=True)
+        _flusher.start()
+    atexit.register(flush)
+
+# ---------------- Read API ----------------
+def get_usage(app_ids, hours: int = 24):
+    """
+    Per-app event totals over the last `hours` hours, including counts this
+    process has not flushed yet.
+    Returns {app_id: {event: count}}.
+    """
+    app_ids = [int(a) for a in app_ids]
+    usage = {app_id: dict.fromkeys(EVENTS, 0) for app_id in app_ids}
+    if not app_ids:
+        return usage
+
+    since = (datetime.utcnow() - timedelta(hours=hours - 1)).strftime("%Y-%m-%d %H:00:00")
+    placeholders = ",".join("?" * len(app_ids))
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT app_id, event, SUM(count) AS total
+        FROM app_usage_hourly
+        WHERE app_id IN ({placeholders}) AND hour >= ?
+        GROUP BY app_id, event
+    """, (*app_ids, since))
+    for row in cur.fetchall():
+        usage[row["app_id"]][row["event"]] = row["total"]
+    conn.close()
+
+    min_hour = int(time.time()) // 3600 - hours + 1
+    with _lock:
+        pending = list(_counters.items())
+    for (app_id, event, hour), count in pending:
+        if app_id in usage and hour >= min_hour:
+            usage[app_id][event] = usage[app_id].get(event, 0) + count
+    return usage
+
+def get_hourly_usage(app_id, hours: int = 24):
+    """Hourly rollup rows for one app, oldest first."""
+    since = (datetime.utcnow() - timedelta(hours=hours - 1)).strftime("%Y-%m-%d %H:00:00")
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT hour, event, count FROM app_usage_hourly
+        WHERE app_id=? AND hour >= ?
+        ORDER BY hour
+    """, (app_id, since))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
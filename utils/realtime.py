@@ -0,0 +1,78 @@
+import json
+from flask import session
+from flask_socketio import SocketIO, join_room
+from config import Config
+from db import get_db_connection
+from utils.auth import is_admin
+
+# ---------------- Realtime Notifications ----------------
+# Writers call publish() with their own cursor, so an event only exists once
+# the change behind it commits. Every worker runs a relay task that tails
+# realtime_events and emits new rows to its own connected sockets; that is
+# the cross-worker fan-out, and it needs nothing beyond the SQLite file.
+#
+# Rooms: "admins" for admin sessions, "user:<id>" for each signed-in user.
+
+socketio = SocketIO()
+
+_relay_started = False
+
+def init_app(app):
+    socketio.init_app(app)
+
+def publish(cur, event: str, payload: dict, user_ids=(), admins: bool = False):
+    """Queue an event for admin sessions and/or the given users."""
+    rooms = [f"user:{uid}" for uid in user_ids if uid is not None]
+    if admins:
+        rooms.append("admins")
+    if not rooms:
+        return
+    data = json.dumps(payload)
+    cur.executemany(
+        "INSERT INTO realtime_events (room, event, payload) VALUES (?, ?, ?)",
+        [(room, event, data) for room in rooms]
+    )
+
+def _relay():
+    last_id = None  # read on the first successful tick: only relay events from then on
+    ticks = 0
+    while True:
+        socketio.sleep(Config.REALTIME_POLL_INTERVAL)
+        ticks += 1
+        try:
+            conn = get_db_connection()
+            try:
+                if last_id is None:
+                    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM realtime_events").fetchone()[0]
+                rows = conn.execute(
+                    "SELECT id, room, event, payload FROM realtime_events WHERE id > ? ORDER BY id",
+                    (last_id,)
+                ).fetchall()
+                # Events are only needed long enough for every worker to relay them
+                if ticks % 60 == 0:
+                    conn.execute("DELETE FROM realtime_events WHERE created_at < datetime('now', '-10 minutes')")
+                    conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Realtime relay failed: {e}")
+            continue
+        for row in rows:
+            socketio.emit(row["event"], json.loads(row["payload"]), to=row["room"])
+            last_id = row["id"]
+
+def _start_relay():
+    global _relay_started
+    if not _relay_started:
+        _relay_started = True
+        socketio.start_background_task(_relay)
+
+@socketio.on("connect")
+def _on_connect(auth=None):
+    user_id = session.get("user_id")
+    if not user_id:
+        return False
+    _start_relay()
+    join_room(f"user:{user_id}")
+    if is_admin():
+        join_room("admins")
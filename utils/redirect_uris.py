@@ -0,0 +1,235 @@
+import re
+import threading
+from urllib.parse import urlsplit, quote, unquote
+
+# ---------------- Redirect URI Registry ----------------
+# Each app has any number of rows in app_redirect_uris. A row is either an
+# exact URI or a pattern:
+#   https://*.tenant.example.com/callback   one extra leftmost host label
+#   https://app.example.com/callback/*      any path under /callback/
+# Rows are compiled once per app into hash lookups, so matching costs the
+# same whether an app registered one URI or thousands.
+#
+# Paths are compared percent-decoded and re-encoded canonically, so
+# /x/%2e%2e/ can't slip past a /x/* prefix. Backslashes, encoded slashes and
+# dot segments (plain or encoded) are rejected outright.
+#
+# Native apps may register private-scheme URIs (com.example.app:/oauth);
+# those are exact-match only.
+
+MAX_URIS_PER_APP = 5000
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_SCHEME_RE = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]*):")
+_FORBIDDEN_SCHEMES = {"javascript", "data", "vbscript", "file", "blob", "about"}
+_PATH_SAFE = "/:@!$&'()*+,;=-._~"
+
+def _normalize_path(path: str) -> str:
+    """Canonical percent-encoding of a path; raises ValueError on traversal tricks."""
+    lowered = path.lower()
+    if "\\" in path or "%5c" in lowered or "%2f" in lowered:
+        raise ValueError("redirect URI path must not contain backslashes or encoded slashes")
+    decoded = unquote(path)
+    if any(segment in (".", "..") for segment in decoded.split("/")):
+        raise ValueError("redirect URI path must not contain dot segments")
+    return quote(decoded, safe=_PATH_SAFE)
+
+def _custom_scheme_uri(uri: str):
+    """Normalized private-scheme URI (exact match only), or None if `uri` is http(s)."""
+    raw = uri.strip()
+    m = _SCHEME_RE.match(raw)
+    if not m or m.group(1).lower() in _DEFAULT_PORTS:
+        return None
+    scheme = m.group(1).lower()
+    if scheme in _FORBIDDEN_SCHEMES:
+        raise ValueError(f"{scheme}: URIs can't be redirect targets")
+    if "#" in raw:
+        raise ValueError("redirect URI must not contain a fragment")
+    if "*" in raw or "\\" in raw or any(c.isspace() for c in raw):
+        raise ValueError(f"invalid redirect URI: {raw}")
+    return scheme + raw[len(scheme):]
+
+def _split(uri: str):
+    """
+    Parse and normalize a URI into (scheme, host, port, path, query).
+    Raises ValueError for anything that must never be a redirect target.
+    """
+    parts = urlsplit(uri.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        raise ValueError("redirect URI must use http or https")
+    if parts.fragment or "#" in uri:
+        raise ValueError("redirect URI must not contain a fragment")
+    if parts.username or parts.password:
+        raise ValueError("redirect URI must not contain credentials")
+    if "\\" in uri:
+        raise ValueError("redirect URI must not contain backslashes")
+    host = (parts.hostname or "").lower().rstrip(".")
+    if not host:
+        raise ValueError("redirect URI must include a host")
+    port = parts.port or _DEFAULT_PORTS[scheme]
+    path = _normalize_path(parts.path or "/")
+    return scheme, host, port, path, parts.query
+
+def normalize_uri(uri: str) -> str:
+    """Canonical text form used for storage and exact matching."""
+    scheme, host, port, path, query = _split(uri)
+    netloc = host if port == _DEFAULT_PORTS[scheme] else f"{host}:{port}"
+    return f"{scheme}://{netloc}{path}" + (f"?{query}" if query else "")
+
+def parse_registration(uri: str):
+    """
+    Validate one registered URI or pattern.
+    Returns (normalized_text, is_pattern) or raises ValueError.
+    """
+    raw = uri.strip()
+    custom = _custom_scheme_uri(raw)
+    if custom is not None:
+        return custom, False
+    wildcard_host = "://*." in raw
+    prefix_path = raw.endswith("/*")
+    if not (wildcard_host or prefix_path):
+        if "*" in raw:
+            raise ValueError(f"unsupported wildcard in {raw}")
+        return normalize_uri(raw), False
+
+    probe = raw.replace("://*.", "://wildcard.", 1) if wildcard_host else raw
+    if prefix_path:
+        probe = probe[:-1]
+    if "*" in probe:
+        raise ValueError(f"only a leading *. host label or a trailing /* path are allowed: {raw}")
+    scheme, host, port, path, query = _split(probe)
+    if query:
+        raise ValueError(f"patterns must not contain a query string: {raw}")
+    if wildcard_host:
+        host = host.split(".", 1)[1]
+        if host.count(".") < 1:
+            raise ValueError(f"wildcard must sit under a registrable domain: {raw}")
+        host = "*." + host
+    netloc = host if port == _DEFAULT_PORTS[scheme] else f"{host}:{port}"
+    return f"{scheme}://{netloc}{path}" + ("*" if prefix_path else ""), True
+
+def parse_uri_list(text: str):
+    """Split a whitespace separated list into validated registrations; returns (registrations, errors)."""
+    registrations, errors, seen = [], [], set()
+    for raw in text.split():
+        try:
+            reg = parse_registration(raw)
+        except ValueError as e:
+            errors.append(str(e))
+            continue
+        if reg[0] not in seen:
+            seen.add(reg[0])
+            registrations.append(reg)
+    if len(registrations) > MAX_URIS_PER_APP:
+        errors.append(f"at most {MAX_URIS_PER_APP} redirect URIs per app")
+    return registrations, errors
+
+# ---------------- Compiled Matcher ----------------
+class RedirectMatcher:
+    def __init__(self, registrations):
+        self.exact = set()
+        # (scheme, host_or_suffix, port, wildcard) -> (exact paths, path prefixes)
+        self.patterns = {}
+        for uri, is_pattern in registrations:
+            if not is_pattern:
+                # Rows stored before path normalization are re-normalized here
+                try:
+                    self.exact.add(_custom_scheme_uri(uri) or normalize_uri(uri))
+                except ValueError:
+                    pass
+                continue
+            prefix = uri.endswith("/*")
+            wildcard = "://*." in uri
+            probe = uri.replace("://*.", "://wildcard.", 1)
+            scheme, host, port, path, _ = _split(probe[:-1] if prefix else probe)
+            if wildcard:
+                host = host.split(".", 1)[1]
+            paths, prefixes = self.patterns.setdefault((scheme, host, port, wildcard), (set(), set()))
+            (prefixes if prefix else paths).add(path)
+
+    def matches(self, uri: str) -> bool:
+        try:
+            custom = _custom_scheme_uri(uri)
+            if custom is not None:
+                return custom in self.exact
+            scheme, host, port, path, query = _split(uri)
+        except ValueError:
+            return False
+        netloc = host if port == _DEFAULT_PORTS[scheme] else f"{host}:{port}"
+        if f"{scheme}://{netloc}{path}" + (f"?{query}" if query else "") in self.exact:
+            return True
+        if not self.patterns:
+            return False
+
+        keys = [(scheme, host, port, False)]
+        label, _, parent = host.partition(".")
+        if label and parent:
+            keys.append((scheme, parent, port, True))
+        for key in keys:
+            entry = self.patterns.get(key)
+            if entry is None:
+                continue
+            paths, prefixes = entry
+            if path in paths:
+                return True
+            if prefixes:
+                # Walk the path's ancestors: /a/b/c -> /a/b/, /a/
+                end = path.rfind("/")
+                while end >= 0:
+                    if path[:end + 1] in prefixes:
+                        return True
+                    end = path.rfind("/", 0, end)
+        return False
+
+_cache = {}  # app_id -> (version, RedirectMatcher)
+_cache_lock = threading.Lock()
+
+# Version of an app's URI set; changes whenever set_redirect_uris() rewrites it.
+URI_VERSION_SQL = "(SELECT MAX(r.id) FROM app_redirect_uris r WHERE r.app_id = apps.id) AS uri_version"
+
+def get_matcher(cur, app):
+    """
+    Compiled matcher for an app row selected with URI_VERSION_SQL.
+    Apps without registry rows fall back to their legacy redirect_uri column.
+    """
+    version = app["uri_version"]
+    cached = _cache.get(app["id"])
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if version is None:
+        registrations, _ = parse_uri_list(app["redirect_uri"] or "")
+    else:
+        cur.execute("SELECT uri, is_pattern FROM app_redirect_uris WHERE app_id=?", (app["id"],))
+        registrations = [(r["uri"], bool(r["is_pattern"])) for r in cur.fetchall()]
+    matcher = RedirectMatcher(registrations)
+    with _cache_lock:
+        _cache[app["id"]] = (version, matcher)
+    return matcher
+
+# ---------------- Storage ----------------
+def set_redirect_uris(cur, app_id, registrations):
+    """Replace an app's registered URIs. Fresh row ids bump the app's uri_version."""
+    cur.execute("DELETE FROM app_redirect_uris WHERE app_id=?", (app_id,))
+    cur.executemany(
+        "INSERT INTO app_redirect_uris (app_id, uri, is_pattern) VALUES (?, ?, ?)",
+        [(app_id, uri, int(is_pattern)) for uri, is_pattern in registrations]
+    )
+
+def get_redirect_uris(cur, app_id):
+    cur.execute("SELECT uri FROM app_redirect_uris WHERE app_id=? ORDER BY id", (app_id,))
+    return [r["uri"] for r in cur.fetchall()]
+
+def migrate_legacy_uris(cur):
+    """Copy apps.redirect_uri lists into the registry for apps that have no rows yet."""
+    cur.execute("""
+        SELECT id, redirect_uri FROM apps
+        WHERE NOT EXISTS (SELECT 1 FROM app_redirect_uris r WHERE r.app_id = apps.id)
+    """)
+    for app in cur.fetchall():
+        registrations, errors = parse_uri_list(app["redirect_uri"] or "")
+        for error in errors:
+            print(f"App {app['id']}: redirect URI not migrated: {error}")
+        if registrations:
+            set_redirect_uris(cur, app["id"], registrations)
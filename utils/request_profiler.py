@@ -0,0 +1,212 @@
+import hashlib
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from functools import lru_cache
+from config import Config
+
+# ---------------- Request Profiler ----------------
+# Profiles a sampled fraction of live requests, plus any request carrying a
+# valid signed X-Profile-Request header. Two modes:
+#   sampler  - a background thread snapshots the request thread's stack every
+#              few ms; cheap, and yields flamegraph-ready collapsed stacks
+#   cprofile - deterministic cProfile of the request, saved as a .prof file
+# Output goes to <LOG_DIR>/profiles/: one file per profiled request, plus
+# aggregate.collapsed summing every sampled stack (sampler mode), which
+# flamegraph.pl or speedscope read directly.
+#
+# The header only works while the profiler is enabled; set the sample rate
+# to 0 to profile nothing but signed requests.
+#
+# When disabled the request hooks return after one flag check and the
+# sampler thread is not running. State is per worker process.
+
+HEADER = "X-Profile-Request"
+TOKEN_TTL = 300  # seconds a signed header stays valid
+
+enabled = Config.PROFILER_ENABLED
+sample_rate = Config.PROFILER_SAMPLE_RATE
+mode = Config.PROFILER_MODE
+interval_ms = Config.PROFILER_INTERVAL_MS
+
+_recent = deque()  # newest last; oldest files are deleted past PROFILER_KEEP
+_aggregate = Counter()
+_lock = threading.Lock()
+_targets = {}  # request thread ident -> Counter of collapsed stacks
+_sampler = None
+
+def profile_dir():
+    return os.path.join(Config.LOG_DIR, "profiles")
+
+def enable(rate=None, new_mode=None, interval=None):
+    global enabled, sample_rate, mode, interval_ms
+    if rate is not None:
+        sample_rate = min(max(rate, 0.0), 1.0)
+    if new_mode in ("sampler", "cprofile"):
+        mode = new_mode
+    if interval is not None and interval > 0:
+        interval_ms = interval
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    """Forget recent profiles and the aggregate (files already written stay on disk)."""
+    with _lock:
+        _recent.clear()
+        _aggregate.clear()
+
+def recent_profiles():
+    with _lock:
+        return list(reversed(_recent))
+
+def top_stacks(limit=20):
+    with _lock:
+        return _aggregate.most_common(limit)
+
+# ---------------- Signed Header ----------------
+def _sign(ts: str) -> str:
+    return hmac.new(Config.SECRET_KEY.encode(), f"profile:{ts}".encode(), hashlib.sha256).hexdigest()
+
+def make_token() -> str:
+    """Header value that forces profiling of a request for the next TOKEN_TTL seconds."""
+    ts = str(int(time.time()))
+    return f"{ts}.{_sign(ts)}"
+
+def _valid_token(value) -> bool:
+    if not value or "." not in value:
+        return False
+    ts, sig = value.split(".", 1)
+    if not ts.isdigit() or abs(time.time() - int(ts)) > TOKEN_TTL:
+        return False
+    return hmac.compare_digest(sig, _sign(ts))
+
+# ---------------- Stack Sampler ----------------
+@lru_cache(maxsize=4096)
+def _label(code):
+    parts = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{'/'.join(parts[-2:])}:{code.co_name}"
+
+def _sample_loop():
+    global _sampler
+    while enabled:
+        time.sleep(interval_ms / 1000)
+        if not _targets:
+            continue
+        frames = sys._current_frames()
+        with _lock:
+            for ident, counter in _targets.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    counter[";".join(reversed(stack))] += 1
+    with _lock:
+        _sampler = None
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="request-profiler", daemon=True)
+            _sampler.start()
+
+# ---------------- Output ----------------
+def _save(entry, samples=None, profile=None):
+    os.makedirs(profile_dir(), exist_ok=True)
+    path = os.path.join(profile_dir(), entry["file"])
+    if profile is not None:
+        profile.dump_stats(path)
+    else:
+        root = f"{entry['method']} {entry['endpoint']}"
+        with open(path, "w") as f:
+            for stack, n in samples.items():
+                f.write(f"{root};{stack} {n}\n")
+
+    with _lock:
+        if samples:
+            for stack, n in samples.items():
+                _aggregate[f"{entry['method']} {entry['endpoint']};{stack}"] += n
+        _recent.append(entry)
+        expired = []
+        while len(_recent) > Config.PROFILER_KEEP:
+            expired.append(_recent.popleft()["file"])
+        aggregate = list(_aggregate.items()) if samples else None
+
+    for name in expired:
+        try:
+            os.remove(os.path.join(profile_dir(), name))
+        except OSError:
+            pass
+    if aggregate is not None:
+        tmp = os.path.join(profile_dir(), "aggregate.collapsed.part")
+        with open(tmp, "w") as f:
+            for stack, n in aggregate:
+                f.write(f"{stack} {n}\n")
+        os.replace(tmp, os.path.join(profile_dir(), "aggregate.collapsed"))
+
+# ---------------- Flask Hooks ----------------
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        if not enabled:
+            return
+        forced = _valid_token(request.headers.get(HEADER))
+        if not forced and random.random() >= sample_rate:
+            return
+        state = {"mode": mode, "start": time.perf_counter(), "forced": forced}
+        if mode == "cprofile":
+            import cProfile  # only needed once someone switches to this mode
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return  # another profiler already owns this thread
+            state["profile"] = profile
+        else:
+            _ensure_sampler()
+            with _lock:
+                _targets[threading.get_ident()] = state["samples"] = Counter()
+        g._request_profile = state
+
+    @app.teardown_request
+    def _finish_profile(exc=None):
+        state = g.pop("_request_profile", None)
+        if state is None:
+            return
+        duration_ms = (time.perf_counter() - state["start"]) * 1000
+        profile = state.get("profile")
+        if profile is not None:
+            profile.disable()
+        else:
+            with _lock:
+                _targets.pop(threading.get_ident(), None)
+
+        endpoint = request.endpoint or "unknown"
+        ext = "prof" if profile is not None else "collapsed"
+        entry = {
+            "time": datetime.utcnow().isoformat(sep=" ", timespec="seconds"),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": endpoint,
+            "duration_ms": round(duration_ms, 2),
+            "mode": state["mode"],
+            "forced": state["forced"],
+            "samples": sum(state["samples"].values()) if profile is None else None,
+            "file": f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{request.method}-{endpoint}.{ext}",
+        }
+        try:
+            _save(entry, samples=state.get("samples"), profile=profile)
+        except OSError as e:
+            print(f"Request profiler could not write {entry['file']}: {e}")
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from config import Config
+from db import get_db_connection
+
+# ---------------- Revocation Epochs ----------------
+# A revocation is a single row in token_revocations stamping "every token
+# issued so far is dead". 0 acts as a wildcard:
+#   (user_id, 0)      -> all tokens of a user, for every app
+#   (0, app_id)       -> all tokens of an app, for every user
+#   (user_id, app_id) -> tokens of a single grant
+#
+# "So far" is the highest oauth_tokens id at revocation time. Ids come from
+# AUTOINCREMENT and every write goes through the writer, so a token minted
+# after the revocation always has a larger id, even within the same second.
+#
+# Every revocation also bumps `generation`. Workers cache the effective
+# cutoff per (user, app) and drop the cache when MAX(generation) moves, so a
+# token check costs one indexed MAX() instead of a correlated sub-select.
+
+# Scalar column for token lookups; pass the row on to is_revoked().
+REVOCATION_VERSION_SQL = "(SELECT MAX(generation) FROM token_revocations) AS revocation_version"
+
+_CUTOFF_SQL = """
+    SELECT MAX(token_id_cutoff) FROM token_revocations
+    WHERE (user_id = ? AND app_id IN (0, ?)) OR (user_id = 0 AND app_id = ?)
+"""
+
+_cache = OrderedDict()  # (user_id, app_id) -> highest revoked token id
+_cache_version = None
+_cache_lock = threading.Lock()
+
+def _set_epoch(cur, user_id, app_id):
+    cur.execute("""
+        INSERT INTO token_revocations (user_id, app_id, revoked_before, token_id_cutoff, generation)
+        VALUES (?, ?, CURRENT_TIMESTAMP,
+                (SELECT COALESCE(MAX(id), 0) FROM oauth_tokens),
+                (SELECT COALESCE(MAX(generation), 0) + 1 FROM token_revocations))
+        ON CONFLICT(user_id, app_id) DO UPDATE SET
+            revoked_before=excluded.revoked_before,
+            token_id_cutoff=excluded.token_id_cutoff,
+            generation=excluded.generation
+    """, (user_id, app_id))
+
+def revoke_user_tokens(cur, user_id):
+    """Invalidate every token issued so far to a user."""
+    _set_epoch(cur, int(user_id), 0)
+
+def revoke_app_tokens(cur, app_id):
+    """Invalidate every token issued so far for an app."""
+    _set_epoch(cur, 0, int(app_id))
+
+def revoke_grant_tokens(cur, user_id, app_id):
+    """Invalidate the tokens a single user holds for a single app."""
+    _set_epoch(cur, int(user_id), int(app_id))
+
+def _cutoff(cur, user_id, app_id, version):
+    global _cache_version
+    if version is None:
+        return 0
+    key = (user_id, app_id)
+    with _cache_lock:
+        if _cache_version != version:
+            _cache.clear()
+            _cache_version = version
+        elif key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    cur.execute(_CUTOFF_SQL, (user_id, app_id, app_id))
+    cutoff = cur.fetchone()[0] or 0
+    with _cache_lock:
+        if _cache_version == version:
+            _cache[key] = cutoff
+            while len(_cache) > Config.REVOCATION_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return cutoff
+
+def is_revoked(cur, row) -> bool:
+    """Check a token row selected with t.id, t.user_id, t.app_id, t.revoked and REVOCATION_VERSION_SQL."""
+    if row["revoked"]:
+        return True
+    return row["id"] <= _cutoff(cur, row["user_id"], row["app_id"], row["revocation_version"])
+
+# ---------------- Lazy Cleanup ----------------
+def purge_dead_tokens(after_id: int = 0, batch_size: int = 500):
+    """
+    Scan the next `batch_size` token rows after `after_id` and delete the
+    expired or revoked ones. Keeps each write transaction short and bounded.
+    Returns (deleted, last id scanned); resume from that id until it is None.
+    """
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT t.id,
+               t.revoked = 1 OR t.expires_at < ? OR t.id <= COALESCE(
+                   (SELECT MAX(r.token_id_cutoff) FROM token_revocations r
+                    WHERE (r.user_id = t.user_id AND r.app_id IN (0, t.app_id))
+                       OR (r.user_id = 0 AND r.app_id = t.app_id)), 0) AS dead
+        FROM oauth_tokens t
+        WHERE t.id > ?
+        ORDER BY t.id
+        LIMIT ?
+    """, (now, after_id, batch_size))
+    rows = cur.fetchall()
+    if not rows:
+        conn.close()
+        return 0, None
+    dead = [(row["id"],) for row in rows if row["dead"]]
+    cur.executemany("DELETE FROM oauth_tokens WHERE id=?", dead)
+    conn.commit()
+    conn.close()
+    return len(dead), rows[-1]["id"]
+
+
+if __name__ == "__main__":
+    total, after_id = 0, 0
+    while after_id is not None:
+        n, after_id = purge_dead_tokens(after_id)
+        total += n
+    print(f"Purged {total} dead tokens.")
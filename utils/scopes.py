@@ -0,0 +1,64 @@
+from functools import lru_cache
+from config import Config
+
+# ---------------- Scope Registry ----------------
+# Every scope has a fixed bit. Codes, tokens and grants store the OR of their
+# bits, so "does A cover B" is a single integer test instead of string
+# splitting. The masks are persisted: only ever append to this table, never
+# renumber or reuse a bit.
+SCOPE_BITS = {
+    "profile": 1 << 0,
+    "email": 1 << 1,
+    "openid": 1 << 2,
+    "app_password": 1 << 3,
+}
+
+# Config.OAUTH_SCOPES picks which of them clients may request
+_unknown = [name.strip() for name in Config.OAUTH_SCOPES if name.strip() and name.strip() not in SCOPE_BITS]
+if _unknown:
+    raise ValueError(f"OAUTH_SCOPES has unknown scopes {', '.join(_unknown)}; add them to utils.scopes.SCOPE_BITS")
+ENABLED_BITS = {name.strip(): SCOPE_BITS[name.strip()] for name in Config.OAUTH_SCOPES if name.strip()}
+ALL_SCOPES = sum(ENABLED_BITS.values())
+
+# Userinfo fields each scope releases
+SCOPE_FIELDS = {
+    "openid": ("username",),
+    "profile": ("username", "name", "phone"),
+    "email": ("email",),
+    "app_password": ("app_password",),
+}
+
+class InvalidScope(ValueError):
+    pass
+
+def compile_scope(scope: str) -> int:
+    """Space separated scope text -> bitmask. Raises InvalidScope for unknown names."""
+    mask = 0
+    for name in scope.split():
+        bit = ENABLED_BITS.get(name)
+        if bit is None:
+            raise InvalidScope(name)
+        mask |= bit
+    return mask
+
+def scope_names(mask: int):
+    return [name for name, bit in SCOPE_BITS.items() if mask & bit]
+
+def covers(granted: int, requested: int) -> bool:
+    return requested & ~granted == 0
+
+@lru_cache(maxsize=None)
+def userinfo_fields(mask):
+    """
+    Ordered tuple of user columns released by a scope mask. username is the
+    subject and is always included. A NULL mask (token issued before scopes
+    were recorded) keeps the old, unprojected payload.
+    """
+    if mask is None:
+        return ("username", "email", "name", "phone", "app_password")
+    fields = ["username"]
+    for name in scope_names(mask):
+        for field in SCOPE_FIELDS.get(name, ()):
+            if field not in fields:
+                fields.append(field)
+    return tuple(fields)
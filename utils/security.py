@@ -31,6 +31,13 @@ def generate_token(length: int = 32) -> str:
     """
     return secrets.token_hex(length)
 
+def hash_token(token: str) -> bytes:
+    """
+    32-byte SHA-256 digest of a token. Tokens and codes are stored and looked
+    up by this digest only; the plaintext is returned to the client once.
+    """
+    return hashlib.sha256(token.encode()).digest()
+
 def generate_client_secret(length: int = 40) -> str:
     """
     Generate secure client secret for OAuth apps.
@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from config import Config
+
+# ---------------- SQL Profiler ----------------
+# When enabled, db.get_db_connection() hands out ProfiledConnection objects
+# whose cursors time every statement. When disabled, plain sqlite3
+# connections are returned, so the only cost is one flag check per connect.
+
+enabled = Config.SQL_PROFILER_ENABLED
+slow_query_ms = Config.SQL_SLOW_QUERY_MS
+request_query_budget = Config.SQL_REQUEST_QUERY_BUDGET
+
+_stats = {}  # normalized sql -> {"calls", "total_ms", "max_ms", "rows"}
+_stats_lock = threading.Lock()
+_request = threading.local()
+
+_logger = logging.getLogger("stybase.sql")
+_logger.propagate = False
+
+def _get_logger():
+    if not _logger.handlers:
+        os.makedirs(Config.LOG_DIR, exist_ok=True)
+        handler = logging.FileHandler(os.path.join(Config.LOG_DIR, "slow_queries.log"))
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        _logger.addHandler(handler)
+        _logger.setLevel(logging.INFO)
+    return _logger
+
+def enable(slow_ms=None, budget=None):
+    global enabled, slow_query_ms, request_query_budget
+    if slow_ms is not None:
+        slow_query_ms = slow_ms
+    if budget is not None:
+        request_query_budget = budget
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+def get_stats(limit: int = 50):
+    """Aggregated statements, slowest total time first."""
+    with _stats_lock:
+        items = [dict(sql=sql, **s) for sql, s in _stats.items()]
+    items.sort(key=lambda s: s["total_ms"], reverse=True)
+    return items[:limit]
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_space_re = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Collapse whitespace and replace literals with ? so variants aggregate together."""
+    return _space_re.sub(" ", _literal_re.sub("?", sql)).strip()
+
+# ---------------- Recording ----------------
+def _record(conn, sql, params, duration_ms, rows):
+    key = normalize(sql)
+    with _stats_lock:
+        s = _stats.get(key)
+        if s is None:
+            s = _stats[key] = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0}
+        s["calls"] += 1
+        s["total_ms"] += duration_ms
+        s["max_ms"] = max(s["max_ms"], duration_ms)
+        s["rows"] += max(rows, 0)
+
+    counts = getattr(_request, "counts", None)
+    if counts is not None:
+        counts[key] = counts.get(key, 0) + 1
+
+    if duration_ms >= slow_query_ms:
+        _log_slow(conn, sql, params, key, duration_ms, rows)
+
+def _log_slow(conn, sql, params, key, duration_ms, rows):
+    try:
+        plan_cur = sqlite3.Cursor(conn)
+        plan_cur.execute("EXPLAIN QUERY PLAN " + sql, params or ())
+        plan = "\n".join(f"    {r[3]}" for r in plan_cur.fetchall())
+        plan_cur.close()
+    except sqlite3.Error as e:
+        plan = f"    (no plan: {e})"
+    _get_logger().warning("slow query %.1fms rows=%d: %s\n%s", duration_ms, rows, key, plan)
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that times execute + fetch and records the statement once it is consumed."""
+    _pending = None
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            sql, params, elapsed, rows = pending
+            if rows == 0 and self.rowcount > 0:
+                rows = self.rowcount  # DML
+            _record(self.connection, sql, params, elapsed * 1000, rows)
+
+    def execute(self, sql, params=()):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._pending = [sql, params, time.perf_counter() - start, 0]
+
+    def executemany(self, sql, seq_of_params):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._pending = [sql, None, time.perf_counter() - start, 0]
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - start
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(super().fetchone)
+        if self._pending is not None:
+            if row is None:
+                self._finish()
+            else:
+                self._pending[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed_fetch(super().fetchmany, size or self.arraysize)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(super().fetchall)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+class ProfiledConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = []
+
+    def cursor(self, factory=ProfiledCursor):
+        cur = super().cursor(factory)
+        self._cursors.append(cur)
+        return cur
+
+    # The C implementations bypass cursor(), so route the shortcuts through it
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def close(self):
+        for cur in self._cursors:
+            if isinstance(cur, ProfiledCursor):
+                cur._finish()
+        self._cursors.clear()
+        super().close()
+
+# ---------------- Per-request Query Budget ----------------
+def init_app(app):
+    """Count queries per request and warn when a request goes over budget."""
+    from flask import request
+
+    @app.before_request
+    def _start_query_count():
+        _request.counts = {} if enabled else None
+
+    @app.teardown_request
+    def _check_query_budget(exc=None):
+        counts, _request.counts = getattr(_request, "counts", None), None
+        if not counts:
+            return
+        total = sum(counts.values())
+        if total > request_query_budget:
+            repeated = sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:3]
+            detail = "; ".join(f"{n}x {sql[:120]}" for sql, n in repeated)
+            _get_logger().warning(
+                "%s %s ran %d queries (budget %d), possible N+1. Most repeated: %s",
+                request.method, request.path, total, request_query_budget, detail
+            )
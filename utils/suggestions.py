@@ -0,0 +1,144 @@
+import base64
+import threading
+from collections import OrderedDict
+from config import Config
+
+# ---------------- Suggestions Feed ----------------
+# Listings are newest first and paginated by keyset on (created_at, id): each
+# page hands back a cursor naming its last row, and the next page starts
+# strictly below it. Cost stays flat no matter how deep a client pages.
+#
+# Search goes through the suggestions_fts index (see db.init_db) and pages
+# on id, which grows with created_at for rows inserted by the app.
+#
+# First pages (the hot path) are cached per process and keyed by the feed
+# version, MAX(id). Any insert, from any worker, bumps the version and so
+# invalidates every cached first page on its next read.
+
+MAX_TITLE = 200
+MAX_CONTENT = 5000
+
+_COLUMNS = "s.id, s.user_id, u.username, s.title, s.content, s.created_at"
+
+_cache = OrderedDict()  # user_id or None -> (version, page)
+_cache_lock = threading.Lock()
+_has_fts = None
+
+# ---------------- Cursors ----------------
+def encode_cursor(created_at, suggestion_id) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{suggestion_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    """(created_at, id) from a cursor string. Raises ValueError when malformed."""
+    try:
+        created_at, suggestion_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return created_at, int(suggestion_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def _page(rows, limit):
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["id"]) if len(rows) > limit else None
+    return {"suggestions": items, "next_cursor": next_cursor}
+
+def clamp_limit(limit):
+    return max(1, min(limit or Config.SUGGESTIONS_PAGE_SIZE, Config.SUGGESTIONS_MAX_PAGE))
+
+# ---------------- Writes ----------------
+def create_suggestion(cur, user_id, title: str, content: str):
+    """Insert a suggestion (writer job). Raises ValueError on invalid input; returns the new id."""
+    title, content = (title or "").strip(), (content or "").strip()
+    if not title or not content:
+        raise ValueError("title and content are required")
+    if len(title) > MAX_TITLE or len(content) > MAX_CONTENT:
+        raise ValueError(f"title is limited to {MAX_TITLE} and content to {MAX_CONTENT} characters")
+    cur.execute(
+        "INSERT INTO suggestions (user_id, title, content) VALUES (?, ?, ?)",
+        (user_id, title, content)
+    )
+    return cur.lastrowid
+
+# ---------------- Reads ----------------
+def _version(cur):
+    cur.execute("SELECT MAX(id) FROM suggestions")
+    return cur.fetchone()[0]
+
+def list_suggestions(cur, limit=None, cursor=None, user_id=None):
+    """
+    One page of suggestions, newest first, optionally for one user.
+    Returns {"suggestions": [...], "next_cursor": str or None}.
+    """
+    limit = clamp_limit(limit)
+    first_page = cursor is None and limit == Config.SUGGESTIONS_PAGE_SIZE
+    if first_page:
+        version = _version(cur)
+        with _cache_lock:
+            cached = _cache.get(user_id)
+            if cached is not None and cached[0] == version:
+                _cache.move_to_end(user_id)
+                return cached[1]
+
+    where, params = [], []
+    if user_id is not None:
+        where.append("s.user_id = ?")
+        params.append(user_id)
+    if cursor is not None:
+        where.append("(s.created_at, s.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    cur.execute(f"""
+        SELECT {_COLUMNS}
+        FROM suggestions s
+        LEFT JOIN users u ON u.id = s.user_id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY s.created_at DESC, s.id DESC
+        LIMIT ?
+    """, (*params, limit + 1))
+    page = _page(cur.fetchall(), limit)
+
+    if first_page:
+        with _cache_lock:
+            _cache[user_id] = (version, page)
+            _cache.move_to_end(user_id)
+            while len(_cache) > Config.SUGGESTIONS_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return page
+
+def _fts_query(q: str) -> str:
+    """Quote every term so user input can't inject FTS5 syntax; terms are ANDed."""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+def search_suggestions(cur, q: str, limit=None, cursor=None):
+    """Full-text search, newest first. Same page shape as list_suggestions()."""
+    global _has_fts
+    limit = clamp_limit(limit)
+    if not q.split():
+        return {"suggestions": [], "next_cursor": None}
+    before_id = decode_cursor(cursor)[1] if cursor is not None else None
+
+    if _has_fts is None:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name='suggestions_fts'")
+        _has_fts = cur.fetchone() is not None
+
+    if _has_fts:
+        cur.execute(f"""
+            SELECT {_COLUMNS}
+            FROM suggestions_fts f
+            JOIN suggestions s ON s.id = f.rowid
+            LEFT JOIN users u ON u.id = s.user_id
+            WHERE suggestions_fts MATCH ? {"AND f.rowid < ?" if before_id is not None else ""}
+            ORDER BY f.rowid DESC
+            LIMIT ?
+        """, (_fts_query(q), *([before_id] if before_id is not None else []), limit + 1))
+    else:
+        # No FTS5 in this SQLite build: correct, but a full scan
+        terms = [f"%{t}%" for t in q.split()]
+        cur.execute(f"""
+            SELECT {_COLUMNS}
+            FROM suggestions s
+            LEFT JOIN users u ON u.id = s.user_id
+            WHERE {" AND ".join("(s.title LIKE ? OR s.content LIKE ?)" for _ in terms)}
+            {"AND s.id < ?" if before_id is not None else ""}
+            ORDER BY s.id DESC
+            LIMIT ?
+        """, (*[t for t in terms for _ in (0, 1)], *([before_id] if before_id is not None else []), limit + 1))
+    return _page(cur.fetchall(), limit)
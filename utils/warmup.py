@@ -0,0 +1,56 @@
+import os
+import time
+from jinja2 import FileSystemBytecodeCache, TemplateError
+from config import Config
+
+# ---------------- Template Warmup ----------------
+# Jinja compiles a template to Python source and then to bytecode the first
+# time each worker renders it, which is what made the first requests after a
+# deploy slow. Two fixes:
+#   - a FileSystemBytecodeCache in TEMPLATE_CACHE_DIR, shared by every worker
+#     on the host: a template is compiled once, later loads just unmarshal it
+#   - precompile(): load every template up front, so no request pays for it.
+#
+# Run `python -m utils.warmup` as a deploy step to fill the cache before the
+# new workers start. TEMPLATE_PRECOMPILE=1 also precompiles at import, which
+# only pays off with `gunicorn --preload` (the forked workers inherit the
+# loaded templates); it is off by default to keep the import cheap.
+
+def init_app(app):
+    if Config.TEMPLATE_CACHE_DIR:
+        os.makedirs(Config.TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(Config.TEMPLATE_CACHE_DIR)
+    if Config.TEMPLATE_PRECOMPILE:
+        _, errors = precompile(app)
+        for name, error in errors:
+            print(f"Template {name} failed to compile: {error}")
+
+def precompile(app):
+    """Load every template into the environment (and bytecode cache). Returns (loaded, [(name, error)])."""
+    env = app.jinja_env
+    loaded, errors = 0, []
+    for name in env.list_templates(extensions=("html",)):
+        try:
+            env.get_template(name)
+            loaded += 1
+        except TemplateError as e:
+            errors.append((name, e))
+    return loaded, errors
+
+
+# ---------------- CLI ----------------
+# python -m utils.warmup
+if __name__ == "__main__":
+    from flask import Flask
+
+    # A bare app with the same template folder: filling the cache does not
+    # need the database, blueprints or background threads of the real one.
+    start = time.perf_counter()
+    app = Flask("app", root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(Config.TEMPLATE_CACHE_DIR)
+    os.makedirs(Config.TEMPLATE_CACHE_DIR, exist_ok=True)
+    loaded, errors = precompile(app)
+    for name, error in errors:
+        print(f"  {name}: {error}")
+    print(f"Compiled {loaded} templates into {Config.TEMPLATE_CACHE_DIR} "
+          f"in {(time.perf_counter() - start) * 1000:.0f} ms ({len(errors)} failed)")
@@ -0,0 +1,343 @@
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from config import Config
+from db import get_db_connection
+
+# ---------------- Webhooks ----------------
+# Apps register one endpoint (apps.webhook_url) and get told when access they
+# hold is taken away, so they can cache userinfo results instead of polling.
+#
+# Writers call queue_event() with their own cursor: the event rows commit
+# (or roll back) with the change behind them. The URL and signing secret are
+# copied into each row, so events about a deleted app are still delivered.
+# A background dispatcher in every worker claims due rows, groups them per
+# endpoint and POSTs each group as one signed JSON batch over a kept-alive
+# connection, retrying failures with exponential backoff. Delivery is
+# at-least-once; receivers dedupe on the event id.
+#
+# Events: user.revoked, user.updated, grant.revoked, app.revoked.
+#
+# Request format:
+#   POST <webhook_url>
+#   X-Stybase-Timestamp: <unix seconds>
+#   X-Stybase-Signature: sha256=<hex HMAC-SHA256(secret, "<timestamp>.<body>")>
+#   {"events": [{"id": 1, "type": "user.revoked", "created_at": "...", "data": {...}}]}
+#
+# The POSTs come from our servers, so endpoints must be https and resolve
+# only to public addresses. That is checked when the URL is saved and again
+# on every connect (DNS can change in between); the connection then goes to
+# the address that was checked. WEBHOOK_ALLOW_LOCALHOST (development only)
+# additionally permits http://localhost for the local receiver below.
+
+USER_AGENT = "Stybase-Webhooks/1.0"
+
+_wakeup = threading.Event()
+_dispatcher = None
+
+_LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+class UnsafeTarget(OSError):
+    """The endpoint resolves to an address webhooks may not call."""
+
+def _is_local_dev(host):
+    return Config.WEBHOOK_ALLOW_LOCALHOST and host in _LOCAL_HOSTS
+
+def _check_scheme(parts):
+    if not parts.hostname or parts.scheme not in ("http", "https"):
+        return "webhook URL must be an absolute https URL"
+    if parts.scheme != "https" and not _is_local_dev(parts.hostname):
+        return "webhook URL must use https"
+    try:
+        parts.port
+    except ValueError:
+        return "webhook URL has an invalid port"
+    return None
+
+def _resolve(host, port):
+    """Addresses for host:port, all of which must be public. Raises UnsafeTarget or socket.gaierror."""
+    addresses = []
+    for *_, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        ip = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        if getattr(ip, "ipv4_mapped", None):
+            ip = ip.ipv4_mapped
+        if ip.is_loopback and _is_local_dev(host):
+            pass
+        elif not ip.is_global or ip.is_multicast or ip.is_reserved:
+            raise UnsafeTarget(f"{host} resolves to non-public address {ip}")
+        addresses.append(sockaddr[0])
+    if not addresses:
+        raise UnsafeTarget(f"{host} did not resolve")
+    return addresses
+
+def validate_url(url: str):
+    """Error message for an unusable endpoint, or None."""
+    parts = urlsplit(url)
+    error = _check_scheme(parts)
+    if error:
+        return error
+    try:
+        _resolve(parts.hostname, parts.port or 443)
+    except UnsafeTarget:
+        return "webhook URL must point to a public address"
+    except (socket.gaierror, UnicodeError):
+        return "webhook host does not resolve"
+    return None
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+
+# ---------------- Outbox ----------------
+def queue_event(cur, event: str, data: dict, app_id=None, user_id=None):
+    """
+    Add an event for one app, or for every app the user has granted access to.
+    Apps without a webhook URL are skipped.
+    """
+    payload = json.dumps(data)
+    if app_id is not None:
+        cur.execute("""
+            INSERT INTO webhook_events (app_id, url, secret, event, payload)
+            SELECT id, webhook_url, webhook_secret, ?, ? FROM apps
+            WHERE id=? AND webhook_url IS NOT NULL
+        """, (event, payload, app_id))
+    elif user_id is not None:
+        cur.execute("""
+            INSERT INTO webhook_events (app_id, url, secret, event, payload)
+            SELECT a.id, a.webhook_url, a.webhook_secret, ?, ? FROM apps a
+            WHERE a.webhook_url IS NOT NULL
+              AND a.id IN (SELECT app_id FROM oauth_authorizations WHERE user_id=?)
+        """, (event, payload, user_id))
+    else:
+        return
+    if cur.rowcount:
+        _wakeup.set()
+
+def delivery_stats(cur, app_id):
+    """Event counts by status and the most recent delivery error for an app."""
+    cur.execute("SELECT status, COUNT(*) FROM webhook_events WHERE app_id=? GROUP BY status", (app_id,))
+    counts = {row[0]: row[1] for row in cur.fetchall()}
+    cur.execute("""
+        SELECT last_error FROM webhook_events
+        WHERE app_id=? AND last_error IS NOT NULL ORDER BY id DESC LIMIT 1
+    """, (app_id,))
+    last = cur.fetchone()
+    return {"counts": counts, "last_error": last["last_error"] if last else None}
+
+# ---------------- Dispatcher ----------------
+def _claim_batch(limit):
+    """Atomically move up to `limit` due events to 'sending'. Returns the claimed rows."""
+    now = datetime.utcnow().isoformat(sep=" ", timespec="seconds")
+    stale = (datetime.utcnow() - timedelta(minutes=10)).isoformat(sep=" ", timespec="seconds")
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Events left in 'sending' by a crashed worker go back in the queue
+    cur.execute("UPDATE webhook_events SET status='pending' WHERE status='sending' AND claimed_at < ?", (stale,))
+    cur.execute("""
+        UPDATE webhook_events SET status='sending', claimed_at=?
+        WHERE id IN (
+            SELECT id FROM webhook_events
+            WHERE status='pending' AND next_attempt_at <= ?
+            ORDER BY id LIMIT ?
+        )
+        RETURNING id, app_id, url, secret, event, payload, attempts, created_at
+    """, (now, now, limit))
+    rows = sorted(cur.fetchall(), key=lambda r: r["id"])
+    conn.commit()
+    conn.close()
+    return rows
+
+def _finish(results):
+    """Record delivery results: list of (id, attempts, error or None)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    for event_id, attempts, error in results:
+        if error is None:
+            cur.execute("""
+                UPDATE webhook_events SET status='delivered', delivered_at=CURRENT_TIMESTAMP, last_error=NULL
+                WHERE id=?
+            """, (event_id,))
+            continue
+        attempts += 1
+        if attempts >= Config.WEBHOOK_MAX_ATTEMPTS:
+            cur.execute("""
+                UPDATE webhook_events SET status='failed', attempts=?, last_error=? WHERE id=?
+            """, (attempts, error, event_id))
+        else:
+            delay = min(Config.WEBHOOK_RETRY_BASE * 2 ** (attempts - 1), 6 * 3600)
+            retry_at = (datetime.utcnow() + timedelta(seconds=delay)).isoformat(sep=" ", timespec="seconds")
+            cur.execute("""
+                UPDATE webhook_events SET status='pending', attempts=?, last_error=?, next_attempt_at=?
+                WHERE id=?
+            """, (attempts, error, retry_at, event_id))
+    conn.commit()
+    conn.close()
+
+def _purge_delivered():
+    conn = get_db_connection()
+    conn.execute("""
+        DELETE FROM webhook_events
+        WHERE status='delivered' AND delivered_at < datetime('now', ?)
+    """, (f"-{Config.WEBHOOK_RETENTION_DAYS} days",))
+    conn.commit()
+    conn.close()
+
+def _connect(scheme, host, port):
+    """
+    Connection pinned to an address that passed _resolve(): the socket goes to
+    that IP while TLS still verifies the certificate against `host`.
+    """
+    cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    conn = cls(host, port, timeout=Config.WEBHOOK_TIMEOUT)
+    address = _resolve(host, conn.port)[0]
+    conn._create_connection = lambda addr, *args: socket.create_connection((address, addr[1]), *args)
+    return conn
+
+class Dispatcher:
+    """Delivers claimed events, keeping one connection open per endpoint host while there is work."""
+
+    def __init__(self, connect=_connect):
+        self._connect = connect
+        self._pool = {}  # (scheme, host, port) -> HTTPConnection
+
+    def close(self):
+        for conn in self._pool.values():
+            conn.close()
+        self._pool.clear()
+
+    def _post(self, url, secret, body):
+        parts = urlsplit(url)
+        error = _check_scheme(parts)  # URLs saved before the rules tightened
+        if error:
+            return error
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": USER_AGENT,
+            "X-Stybase-Timestamp": timestamp,
+            "X-Stybase-Signature": "sha256=" + sign(secret, timestamp, body),
+        }
+        for retry in (False, True):
+            conn = self._pool.get(key)
+            if conn is None:
+                conn = self._pool[key] = self._connect(*key)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # Kept-alive connection went away; reconnect once and retry this batch
+                self._pool.pop(key).close()
+                if retry:
+                    raise
+            except (OSError, http.client.HTTPException):
+                self._pool.pop(key).close()
+                raise
+        if response.will_close:
+            self._pool.pop(key).close()
+        if not 200 <= response.status < 300:
+            return f"HTTP {response.status}"
+        return None
+
+    def send_pending(self):
+        """Deliver one claim of due events. Returns the number claimed."""
+        rows = _claim_batch(Config.WEBHOOK_CLAIM_SIZE)
+        groups = {}
+        for row in rows:
+            groups.setdefault((row["url"], row["secret"]), []).append(row)
+
+        results = []
+        for (url, secret), events in groups.items():
+            error = None
+            for i in range(0, len(events), Config.WEBHOOK_BATCH_SIZE):
+                batch = events[i:i + Config.WEBHOOK_BATCH_SIZE]
+                if error is None:
+                    body = json.dumps({"events": [
+                        {"id": e["id"], "type": e["event"], "created_at": e["created_at"],
+                         "data": json.loads(e["payload"])}
+                        for e in batch
+                    ]}).encode()
+                    try:
+                        error = self._post(url, secret, body)
+                    except (OSError, http.client.HTTPException) as e:
+                        error = str(e)[:500] or type(e).__name__
+                # After a failure the endpoint's remaining batches wait for the retry
+                results.extend((e["id"], e["attempts"], error) for e in batch)
+        if results:
+            _finish(results)
+        return len(rows)
+
+def _dispatch_loop():
+    dispatcher = Dispatcher()
+    rounds = 0
+    while True:
+        _wakeup.wait(Config.WEBHOOK_POLL_INTERVAL)
+        _wakeup.clear()
+        rounds += 1
+        try:
+            while dispatcher.send_pending():
+                pass
+            if rounds % 720 == 0:
+                _purge_delivered()
+        except Exception as e:
+            print(f"Webhook dispatcher failed: {e}")
+        dispatcher.close()
+
+def start_dispatcher():
+    """Start the background dispatcher for this process (no-op when webhooks are disabled)."""
+    global _dispatcher
+    if not Config.WEBHOOKS_ENABLED or _dispatcher is not None:
+        return
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="webhook-dispatcher", daemon=True)
+    _dispatcher.start()
+
+
+# ---------------- Local Receiver ----------------
+# python -m utils.webhooks --port 8765 --secret <signing secret>
+# A stand-in endpoint for development: with WEBHOOK_ALLOW_LOCALHOST=1, register
+# http://localhost:8765/ on an app, then revoke something and watch the
+# batches arrive.
+if __name__ == "__main__":
+    import argparse
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    parser = argparse.ArgumentParser(description="Print and verify Stybase webhook deliveries.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--secret", help="signing secret; signatures are not checked without it")
+    parser.add_argument("--status", type=int, default=200, help="status to answer with (e.g. 500 to test retries)")
+    args = parser.parse_args()
+
+    class Receiver(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the dispatcher expects
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            verdict = "unchecked"
+            if args.secret:
+                expected = "sha256=" + sign(args.secret, self.headers.get("X-Stybase-Timestamp", ""), body)
+                ok = hmac.compare_digest(expected, self.headers.get("X-Stybase-Signature", ""))
+                verdict = "valid" if ok else "INVALID"
+            events = json.loads(body).get("events", [])
+            print(f"{self.path}: {len(events)} event(s), signature {verdict}", flush=True)
+            for event in events:
+                print(f"  #{event['id']} {event['type']} {json.dumps(event['data'])}", flush=True)
+            self.send_response(args.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *_):
+            pass
+
+    print(f"Listening on http://localhost:{args.port}/", flush=True)
+    ThreadingHTTPServer(("127.0.0.1", args.port), Receiver).serve_forever()
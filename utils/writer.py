@@ -0,0 +1,205 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from config import Config
+from db import get_db_connection
+
+# ---------------- Single Writer ----------------
+# All request-path mutations go through one writer thread per process. It
+# drains whatever is queued, runs each job inside its own SAVEPOINT, and
+# commits the whole group with one COMMIT (one WAL fsync). A job that fails
+# only rolls back its own savepoint; the others still commit. If SQLite
+# aborts the whole transaction instead, the failing job is dropped and the
+# rest of the group is run again in a fresh one.
+#
+# A job is a callable taking a cursor as its first argument. It must not
+# commit, roll back or close anything. Its return value (or exception) is
+# delivered to the caller after the group commits.
+
+class WriteQueueFull(Exception):
+    """The writer is saturated; the caller should fail fast instead of piling on."""
+
+class WriteTimeout(WriteQueueFull):
+    """A job was not committed within WRITE_RESULT_TIMEOUT. It may still commit later."""
+
+class WriteCoordinator:
+    def __init__(self, maxsize=None, batch_size=None):
+        self._queue = queue.Queue(maxsize=maxsize or Config.WRITE_QUEUE_SIZE)
+        self._batch_size = batch_size or Config.WRITE_BATCH_SIZE
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "jobs": 0,
+            "failed_jobs": 0,
+            "commits": 0,
+            "failed_commits": 0,
+            "rejected": 0,
+            "max_batch": 0,
+            "last_commit_ms": 0.0,
+            "max_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+        }
+
+    # ---------------- Submission ----------------
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("write jobs must not submit other write jobs")
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((fn, args, kwargs, future), timeout=Config.WRITE_QUEUE_TIMEOUT)
+        except queue.Full:
+            with self._metrics_lock:
+                self._metrics["rejected"] += 1
+            raise WriteQueueFull(f"write queue full ({self._queue.maxsize} pending)")
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Submit a job and wait for its committed result (re-raises its exception)."""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=Config.WRITE_RESULT_TIMEOUT)
+        except FutureTimeout:
+            future.cancel()  # only succeeds if the writer hasn't picked it up yet
+            raise WriteTimeout(f"write not committed within {Config.WRITE_RESULT_TIMEOUT:g}s")
+
+    def _ensure_started(self):
+        # Also restarts the thread in a child process after a fork, or if it died
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                if self._thread is not None and self._pid == os.getpid():
+                    print("Writer thread died, restarting it")
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+
+    # ---------------- Writer Thread ----------------
+    def _loop(self):
+        conn = get_db_connection()
+        conn.isolation_level = None  # we issue BEGIN/COMMIT ourselves
+        cur = conn.cursor()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self._batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._run_batch(cur, batch)
+                except Exception as e:
+                    # Never let one bad batch kill the writer thread
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    try:
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                    except Exception as rollback_error:
+                        print(f"Writer rollback failed, reconnecting: {rollback_error}")
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                        conn = get_db_connection()
+                        conn.isolation_level = None
+                        cur = conn.cursor()
+        finally:
+            # A dying thread must not keep the write lock; closing rolls back
+            conn.close()
+
+    def _run_batch(self, cur, batch):
+        # Jobs whose caller gave up (WriteTimeout) before we got to them are skipped
+        batch = [job for job in batch if job[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        failed = []
+        while True:
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+                for future, error in failed:
+                    future.set_exception(error)
+                return
+
+            done, aborted = [], False
+            for i, job in enumerate(batch):
+                fn, args, kwargs, future = job
+                cur.execute("SAVEPOINT job")
+                try:
+                    result = fn(cur, *args, **kwargs)
+                    cur.execute("RELEASE job")
+                    done.append((job, result))
+                except Exception as e:
+                    failed.append((future, e))
+                    try:
+                        cur.execute("ROLLBACK TO job")
+                        cur.execute("RELEASE job")
+                    except Exception:
+                        # SQLite aborted the whole transaction, taking the
+                        # jobs before this one with it: drop the failing job
+                        # and run the rest again
+                        if cur.connection.in_transaction:
+                            cur.execute("ROLLBACK")
+                        batch = [j for j, _ in done] + batch[i + 1:]
+                        aborted = True
+                        break
+            if not aborted:
+                break
+        outcomes = [(job[3], result, None) for job, result in done] + [(f, None, e) for f, e in failed]
+
+        start = time.perf_counter()
+        try:
+            cur.execute("COMMIT")
+        except Exception as e:
+            try:
+                cur.execute("ROLLBACK")
+            except Exception:
+                pass
+            with self._metrics_lock:
+                self._metrics["failed_commits"] += 1
+            for future, _, error in outcomes:
+                future.set_exception(error or e)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._metrics_lock:
+            m = self._metrics
+            m["commits"] += 1
+            m["jobs"] += len(outcomes)
+            m["failed_jobs"] += len(failed)
+            m["max_batch"] = max(m["max_batch"], len(outcomes))
+            m["last_commit_ms"] = elapsed_ms
+            m["max_commit_ms"] = max(m["max_commit_ms"], elapsed_ms)
+            m["total_commit_ms"] += elapsed_ms
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # ---------------- Metrics ----------------
+    def metrics(self):
+        with self._metrics_lock:
+            m = dict(self._metrics)
+        m["queue_depth"] = self._queue.qsize()
+        m["queue_capacity"] = self._queue.maxsize
+        m["avg_batch"] = m["jobs"] / m["commits"] if m["commits"] else 0.0
+        m["avg_commit_ms"] = m["total_commit_ms"] / m["commits"] if m["commits"] else 0.0
+        return m
+
+writer = WriteCoordinator()
+
+def run_write(fn, *args, **kwargs):
+    """Run a write job on this process's writer thread and return its result."""
+    return writer.run(fn, *args, **kwargs)